@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
+import bisect
+import functools
+import re
 import sys
 import unicodedata
+from array import array
 
 START, END = ord(' '), sys.maxunicode + 1           # <1>
 
@@ -12,9 +16,58 @@ def find(*query_words, start=START, end=END):       # <2>
         if name and query.issubset(name.split()):   # <6>
             print(f'U+{code:04X}\t{char}\t{name}')  # <7>
 
+@functools.cache
+def names_table():
+    """Return all character names as one string, each name preceded by a
+    newline, with arrays of the offset where each name starts and its
+    code point. Built on the first call, then reused by every scan."""
+    codes = array('I')
+    names = []
+    for code in range(START, END):
+        name = unicodedata.name(chr(code), None)
+        if name:
+            codes.append(code)
+            names.append(name)
+    offsets = array('I', [1])
+    for name in names:
+        offsets.append(offsets[-1] + len(name) + 1)
+    return '\n' + '\n'.join(names) + '\n', offsets, codes
+
+def word_pattern(word):
+    """Compile regex matching word as a whole word of a name, where words
+    are separated by spaces; hyphens are part of a word, as in str.split.
+    The word comes first, so the regex engine can skip ahead to it."""
+    word = re.escape(word)
+    return re.compile(rf'{word}(?<=[ \n]{word})(?=[ \n])')
+
+def scan(*query_words, start=START, end=END):
+    """Like find, but searching the cached table of names: a regex pass
+    finds the names with the longest query word, then only those names
+    are checked for the other words."""
+    query = {w.upper() for w in query_words}
+    if not query:
+        return
+    table, offsets, codes = names_table()
+    pivot = max(query, key=len)  # longer words tend to be rarer
+    last = -1
+    for match in word_pattern(pivot).finditer(table):
+        line = bisect.bisect_right(offsets, match.start()) - 1
+        if line == last:  # same word twice in one name
+            continue
+        last = line
+        code = codes[line]
+        if start <= code < end:
+            name = table[offsets[line]:offsets[line + 1] - 1]
+            if query.issubset(name.split()):
+                print(f'U+{code:04X}\t{chr(code)}\t{name}')
+
 def main(words):
+    search = find
+    if words[:1] == ['--scan']:
+        search = scan
+        words = words[1:]
     if words:
-        find(*words)
+        search(*words)
     else:
         print('Please provide words to find.')
 
@@ -24,6 +24,7 @@
 
 import sys
 import argparse
+import codecs
 from uuid import uuid4
 import os
 
@@ -41,19 +42,30 @@ ISIS_MFN_KEY = 'mfn'
 ISIS_ACTIVE_KEY = 'active'
 SUBFIELD_DELIMITER = '^'
 INPUT_ENCODING = 'cp1252'
+JOB_CHUNK = 1000  # records converted at a time by each --jobs process
+JOB_CHUNKS_AHEAD = 2  # chunks per process queued or waiting to be written
+MONGO_BATCH = 1000  # records per insert_many call with --mongo-uri
+MONGO_QUEUE_BATCHES = 4  # batches converted ahead of the inserts
+MONGO_DEFAULT_DB = 'isis'  # if the --mongo-uri has no database
 
 
-def iter_iso_records(iso_file_name, isis_json_type):  # <1>
+def iter_iso_records(iso_file_name, isis_json_type, skip=0, offset=None):  # <1>
     from iso2709 import IsoFile
     from subfield import expand
 
     iso = IsoFile(iso_file_name)
-    for record in iso:
+    if offset is None:
+        records = iso.records(skip)  # seeks to skip if indexed
+    else:
+        iso.seek(offset)  # the file offset of record skip, known by the caller
+        records = iso
+    for record in records:
         fields = {}
         for field in record.directory:
             field_key = str(int(field.tag))  # remove leading zeroes
             field_occurrences = fields.setdefault(field_key, [])
-            content = field.value.decode(INPUT_ENCODING, 'replace')
+            # field.value is a memoryview, decoded without copying it first
+            content = codecs.decode(field.value, INPUT_ENCODING, 'replace')
             if isis_json_type == 1:
                 field_occurrences.append(content)
             elif isis_json_type == 2:
@@ -115,9 +127,61 @@ def iter_mst_records(master_file_name, isis_json_type):  # <2>
     mst.close()
 
 
+def convert_record(record, i, id_tag, gen_uuid, mfn, isis_json_type,
+                   prefix, constant):
+    # set the "_id" of record number i, and rename its tags; return the
+    # id taken from the id_tag field, to be checked for duplicates
+    id = None
+    if id_tag:
+        occurrences = record.get(id_tag, None)
+        if occurrences is None:
+            msg = 'id tag #%s not found in record %s'
+            if ISIS_MFN_KEY in record:
+                msg = msg + (' (mfn=%s)' % record[ISIS_MFN_KEY])
+            raise KeyError(msg % (id_tag, i))
+        if len(occurrences) > 1:
+            msg = 'multiple id tags #%s found in record %s'
+            if ISIS_MFN_KEY in record:
+                msg = msg + (' (mfn=%s)' % record[ISIS_MFN_KEY])
+            raise TypeError(msg % (id_tag, i))
+        else:  # ok, we have one and only one id field
+            if isis_json_type == 1:
+                id = occurrences[0]
+            elif isis_json_type == 2:
+                id = occurrences[0][0][1]
+            elif isis_json_type == 3:
+                id = occurrences[0]['_']
+            record['_id'] = id
+    elif gen_uuid:
+        record['_id'] = str(uuid4())
+    elif mfn:
+        record['_id'] = record[ISIS_MFN_KEY]
+    if prefix:
+        # iterate over a fixed sequence of tags
+        for tag in tuple(record):
+            if str(tag).isdigit():
+                record[prefix+tag] = record[tag]
+                del record[tag]  # this is why we iterate over a tuple
+                # with the tags, and not directly on the record dict
+    if constant:
+        constant_key, constant_value = constant.split(':')
+        record[constant_key] = constant_value
+    return id
+
+
+def check_id(ids, id, id_tag, i, record=None):
+    if id in ids:
+        msg = 'duplicate id %s in tag #%s, record %s'
+        if record is not None and ISIS_MFN_KEY in record:
+            msg = msg + (' (mfn=%s)' % record[ISIS_MFN_KEY])
+        raise TypeError(msg % (id, id_tag, i))
+    ids.add(id)
+
+
 def write_json(input_gen, file_name, output, qty, skip, id_tag,  # <3>
                gen_uuid, mongo, mfn, isis_json_type, prefix,
-               constant):
+               constant, first=0):
+    # first: number of the first record of input_gen, if it skipped some
     start = skip
     end = start + qty
     if id_tag:
@@ -125,61 +189,187 @@ def write_json(input_gen, file_name, output, qty, skip, id_tag,  # <3>
         ids = set()
     else:
         id_tag = ''
-    for i, record in enumerate(input_gen):
+    for i, record in enumerate(input_gen, first):
         if i >= end:
             break
         if not mongo:
-            if i == 0:
+            if i == first:
                 output.write('[')
             elif i > start:
                 output.write(',')
         if start <= i < end:
+            id = convert_record(record, i, id_tag, gen_uuid, mfn,
+                                isis_json_type, prefix, constant)
             if id_tag:
-                occurrences = record.get(id_tag, None)
-                if occurrences is None:
-                    msg = 'id tag #%s not found in record %s'
-                    if ISIS_MFN_KEY in record:
-                        msg = msg + (' (mfn=%s)' % record[ISIS_MFN_KEY])
-                    raise KeyError(msg % (id_tag, i))
-                if len(occurrences) > 1:
-                    msg = 'multiple id tags #%s found in record %s'
-                    if ISIS_MFN_KEY in record:
-                        msg = msg + (' (mfn=%s)' % record[ISIS_MFN_KEY])
-                    raise TypeError(msg % (id_tag, i))
-                else:  # ok, we have one and only one id field
-                    if isis_json_type == 1:
-                        id = occurrences[0]
-                    elif isis_json_type == 2:
-                        id = occurrences[0][0][1]
-                    elif isis_json_type == 3:
-                        id = occurrences[0]['_']
-                    if id in ids:
-                        msg = 'duplicate id %s in tag #%s, record %s'
-                        if ISIS_MFN_KEY in record:
-                            msg = msg + (' (mfn=%s)' % record[ISIS_MFN_KEY])
-                        raise TypeError(msg % (id, id_tag, i))
-                    record['_id'] = id
-                    ids.add(id)
-            elif gen_uuid:
-                record['_id'] = unicode(uuid4())
-            elif mfn:
-                record['_id'] = record[ISIS_MFN_KEY]
-            if prefix:
-                # iterate over a fixed sequence of tags
-                for tag in tuple(record):
-                    if str(tag).isdigit():
-                        record[prefix+tag] = record[tag]
-                        del record[tag]  # this is why we iterate over a tuple
-                        # with the tags, and not directly on the record dict
-            if constant:
-                constant_key, constant_value = constant.split(':')
-                record[constant_key] = constant_value
-            output.write(json.dumps(record).encode('utf-8'))
+                check_id(ids, id, id_tag, i, record)
+            # ASCII only, as json.dumps escapes other characters
+            output.write(json.dumps(record))
             output.write('\n')
     if not mongo:
         output.write(']\n')
 
 
+def convert_iso_chunk(iso_file_name, start, offset, stop, id_tag, gen_uuid,
+                      isis_json_type, prefix, constant):
+    # run in a worker process by write_json_jobs: convert records start
+    # to stop-1, seeking to offset, the file offset of record start;
+    # return their ids and JSON lines, and the error raised reading or
+    # converting the next record, if any; a record that was read but
+    # not converted has None as its line
+    ids = []
+    lines = []
+    records = iter_iso_records(iso_file_name, isis_json_type, start, offset)
+    try:
+        for i, record in zip(range(start, stop), records):
+            ids.append(None)
+            lines.append(None)
+            ids[-1] = convert_record(record, i, id_tag, gen_uuid, False,
+                                     isis_json_type, prefix, constant)
+            lines[-1] = json.dumps(record) + '\n'
+    except Exception as exc:
+        return ids, lines, exc
+    finally:
+        records.close()
+    return ids, lines, None
+
+
+def write_json_jobs(iso_file_name, output, qty, skip, id_tag, gen_uuid,
+                    mongo, isis_json_type, prefix, constant, jobs):
+    # like write_json for an .iso file, converting JOB_CHUNK records at
+    # a time in each of jobs processes, and writing them in order
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+    from iso2709 import IsoFile
+
+    iso = IsoFile(iso_file_name)
+    try:
+        # read the index, or build it: the workers get their offsets
+        # from it, even if it could not be saved
+        offsets = iso.load_index()
+    except Exception:
+        # a broken record stops the index: convert up to it, in order
+        return write_json(iter_iso_records(iso_file_name, isis_json_type, skip),
+                          iso_file_name, output, qty, skip, id_tag, gen_uuid,
+                          mongo, False, isis_json_type, prefix, constant, skip)
+    finally:
+        iso.close()
+    end = min(skip + qty, len(offsets))
+    id_tag = str(id_tag) if id_tag else ''
+    ids = set()
+    chunks = ((i, offsets[i], min(i + JOB_CHUNK, end))
+              for i in range(skip, end, JOB_CHUNK))
+    with ProcessPoolExecutor(jobs) as executor:
+        pending = deque()
+        try:
+            while True:
+                # keep every worker busy, with a few chunks converted ahead
+                while len(pending) < jobs * JOB_CHUNKS_AHEAD:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    pending.append((chunk[0], executor.submit(
+                        convert_iso_chunk, iso_file_name, *chunk,
+                        id_tag, gen_uuid, isis_json_type, prefix, constant)))
+                if not pending:
+                    break
+                i, future = pending.popleft()
+                chunk_ids, lines, error = future.result()
+                for id, line in zip(chunk_ids, lines):
+                    if not mongo:
+                        output.write('[' if i == skip else ',')
+                    if line is None:
+                        break
+                    if id_tag:
+                        check_id(ids, id, id_tag, i)
+                    output.write(line)
+                    i += 1
+                if error is not None:
+                    raise error
+        except BaseException:
+            for i, future in pending:
+                future.cancel()
+            raise
+    if not mongo:
+        output.write(']\n')
+
+
+def insert_batches(collection, batches, errors):
+    # run in a thread by write_mongo: insert each batch taken from the
+    # batches queue until None; after an error, just drain the queue
+    while True:
+        batch = batches.get()
+        if batch is None:
+            break
+        if errors:
+            continue
+        try:
+            # unordered: the server inserts every record it can of a
+            # batch, even after an error such as a duplicate _id
+            collection.insert_many(batch, ordered=False)
+        except Exception as exc:
+            errors.append(exc)
+
+
+def write_mongo(input_gen, collection, qty, skip, id_tag, gen_uuid, mfn,
+                isis_json_type, prefix, constant, first=0,
+                batch_size=MONGO_BATCH):
+    # like write_json, but inserting records into a MongoDB collection,
+    # or anything with a compatible insert_many method, batch_size
+    # records at a time; a thread inserts each batch while the next one
+    # is converted; return the number of records inserted
+    import threading
+    try:
+        from queue import Queue
+    except ImportError:  # Python 2
+        from Queue import Queue
+
+    start = skip
+    end = start + qty
+    id_tag = str(id_tag) if id_tag else ''
+    ids = set()
+    batches = Queue(MONGO_QUEUE_BATCHES)  # bounds memory if inserts lag
+    errors = []
+    inserter = threading.Thread(target=insert_batches,
+                                args=(collection, batches, errors))
+    inserter.start()
+    count = 0
+    batch = []
+    try:
+        for i, record in enumerate(input_gen, first):
+            if i >= end or errors:
+                break
+            if i < start:
+                continue
+            id = convert_record(record, i, id_tag, gen_uuid, mfn,
+                                isis_json_type, prefix, constant)
+            if id_tag:
+                check_id(ids, id, id_tag, i, record)
+            batch.append(record)
+            if len(batch) == batch_size:
+                batches.put(batch)
+                count += len(batch)
+                batch = []
+        if batch and not errors:
+            batches.put(batch)
+            count += len(batch)
+    finally:
+        batches.put(None)
+        inserter.join()
+    if errors:
+        raise errors[0]
+    return count
+
+
+def mongo_collection(uri, name):
+    try:
+        from pymongo import MongoClient
+    except ImportError:
+        print('IMPORT ERROR: pymongo is required for the --mongo-uri option')
+        raise SystemExit
+    client = MongoClient(uri)
+    return client.get_default_database(MONGO_DEFAULT_DB)[name]
+
+
 def main():  # <4>
     # create the parser
     parser = argparse.ArgumentParser(
@@ -211,7 +401,9 @@ def main():  # <4>
         help='maximum quantity of records to read (default=ALL)')
     parser.add_argument(
         '-s', '--skip', type=int, default=0,
-        help='records to skip from start of .mst (default=0)')
+        help='records to skip from start of .mst or .iso (default=0);'
+             ' reading all of an .iso file once saves an index next to'
+             ' it, to seek to any record later')
     parser.add_argument(
         '-i', '--id', type=int, metavar='TAG_NUMBER', default=0,
         help='generate an "_id" from the given unique TAG field number'
@@ -230,6 +422,22 @@ def main():  # <4>
     parser.add_argument(
         '-k', '--constant', type=str, metavar='TAG:VALUE', default='',
         help='Include a constant tag:value in every record (ex. -k type:AS)')
+    parser.add_argument(
+        '-j', '--jobs', type=int, metavar='N', default=1,
+        help='convert records in N processes, writing them in order'
+             ' (available only for .iso input; default=1)')
+    parser.add_argument(
+        '--mongo-uri', metavar='URI', default='',
+        help='insert records into MongoDB instead of writing JSON, ex.'
+             ' mongodb://localhost:27017/isis (default database: %s)'
+             % MONGO_DEFAULT_DB)
+    parser.add_argument(
+        '--collection', metavar='NAME', default='',
+        help='collection for --mongo-uri'
+             ' (default: input file name without extension)')
+    parser.add_argument(
+        '--batch', type=int, metavar='SIZE', default=MONGO_BATCH,
+        help='records per insert with --mongo-uri (default=%s)' % MONGO_BATCH)
 
     '''
     # TODO: implement this to export large quantities of records to CouchDB
@@ -247,12 +455,37 @@ def main():  # <4>
             print('UNSUPORTED: -n/--mfn option only available for .mst input.')
             raise SystemExit
         input_gen_func = iter_iso_records  # <6>
-    input_gen = input_gen_func(args.file_name, args.type)  # <7>
+    if args.jobs > 1 and input_gen_func is not iter_iso_records:
+        print('UNSUPORTED: -j/--jobs option only available for .iso input.')
+        raise SystemExit
+    if args.jobs > 1 and args.mongo_uri:
+        print('UNSUPORTED: -j/--jobs option not available with --mongo-uri.')
+        raise SystemExit
+    if input_gen_func is iter_iso_records:
+        first = args.skip
+        input_gen = input_gen_func(args.file_name, args.type, first)  # <7>
+    else:
+        first = 0
+        input_gen = input_gen_func(args.file_name, args.type)
+    if args.mongo_uri:
+        name = args.collection or os.path.splitext(
+            os.path.basename(args.file_name))[0]
+        collection = mongo_collection(args.mongo_uri, name)
+        count = write_mongo(input_gen, collection, args.qty, args.skip,
+                            args.id, args.uuid, args.mfn, args.type,
+                            args.prefix, args.constant, first, args.batch)
+        print('%s records inserted into %s' % (count, collection.full_name))
+        return
     if args.couch:
         args.out.write('{ "docs" : ')
-    write_json(input_gen, args.file_name, args.out, args.qty,  # <8>
-               args.skip, args.id, args.uuid, args.mongo, args.mfn,
-               args.type, args.prefix, args.constant)
+    if args.jobs > 1:
+        write_json_jobs(args.file_name, args.out, args.qty, args.skip,
+                        args.id, args.uuid, args.mongo, args.type,
+                        args.prefix, args.constant, args.jobs)
+    else:
+        write_json(input_gen, args.file_name, args.out, args.qty,  # <8>
+                   args.skip, args.id, args.uuid, args.mongo, args.mfn,
+                   args.type, args.prefix, args.constant, first)
     if args.couch:
         args.out.write('}\n')
     args.out.close()
@@ -0,0 +1,147 @@
+import json
+import random
+import sys
+import threading
+import time
+
+import pytest
+
+import iso2709
+import isis2json
+from iso2709_test import LINE_BREAKS, random_fields, write_iso
+
+
+@pytest.fixture(scope='module')
+def records():
+    rnd = random.Random(2)
+    # tag 5 holds a unique id
+    return [[(5, b'%d' % i)] + random_fields(rnd) for i in range(300)]
+
+
+def run_main(monkeypatch, out_path, *args):
+    monkeypatch.setattr(sys, 'argv', ['isis2json.py', *args, '-o', str(out_path)])
+    try:
+        isis2json.main()
+    except Exception as exc:  # compared between runs, with the output
+        return out_path.read_bytes(), repr(exc)
+    return out_path.read_bytes(), None
+
+
+@pytest.mark.parametrize('line_break', LINE_BREAKS.values())
+@pytest.mark.parametrize('options', [
+    ['-m'],
+    ['-m', '-s', '37', '-q', '150'],
+    ['-m', '-t', '3', '-i', '5', '-s', '250'],
+    ['-t', '2', '-p', 'v', '-k', 'type:AS', '-q', '299'],
+    ['-c', '-s', '300'],
+])
+def test_jobs_output_is_identical(records, tmp_path, monkeypatch, line_break, options):
+    monkeypatch.setattr(isis2json, 'JOB_CHUNK', 16)  # many chunks, in order
+    iso_path = write_iso(tmp_path / 'input.iso', records, line_break)
+    expected = run_main(monkeypatch, tmp_path / 'seq.json', iso_path, *options)
+    assert expected[1] is None
+    assert expected[0]
+    result = run_main(monkeypatch, tmp_path / 'jobs.json', iso_path, *options, '-j', '4')
+    assert result == expected
+
+
+@pytest.mark.parametrize('error_at', [5, 250])
+def test_jobs_error_output_is_identical(records, tmp_path, monkeypatch, error_at):
+    monkeypatch.setattr(isis2json, 'JOB_CHUNK', 16)
+    records = list(records)
+    records[error_at] = [(5, b'3')] + records[error_at][1:]  # duplicate id
+    iso_path = write_iso(tmp_path / 'input.iso', records)
+    for options in ['-m', '-i', '5'], ['-i', '5']:
+        expected = run_main(monkeypatch, tmp_path / 'seq.json', iso_path, *options)
+        assert expected[1] == repr(TypeError(
+            'duplicate id 3 in tag #5, record %d' % error_at))
+        result = run_main(monkeypatch, tmp_path / 'jobs.json', iso_path, *options, '-j', '4')
+        assert result == expected
+
+
+def test_jobs_without_saved_index(records, tmp_path, monkeypatch):
+    # as in a read-only directory: workers seek to offsets from the parent
+    monkeypatch.setattr(isis2json, 'JOB_CHUNK', 16)
+    monkeypatch.setattr(iso2709.IsoFile, 'save_index', lambda self, offsets: None)
+    read_records = iso2709.IsoFile.records
+
+    def records_from_start(self, start=0, stop=None):
+        assert start == 0, 'records before %d read again' % start
+        return read_records(self, start, stop)
+
+    monkeypatch.setattr(iso2709.IsoFile, 'records', records_from_start)
+    iso_path = write_iso(tmp_path / 'input.iso', records, b'\r\n')
+    expected = run_main(monkeypatch, tmp_path / 'seq.json', iso_path, '-m')
+    assert expected[1] is None
+    result = run_main(monkeypatch, tmp_path / 'jobs.json', iso_path, '-m', '-j', '4')
+    assert result == expected
+    assert not (tmp_path / 'input.iso.idx').exists()
+
+
+class Collection:
+    """Stands in for a pymongo collection"""
+
+    def __init__(self, fail_at=None):
+        self.batches = []
+        self.fail_at = fail_at  # batch number that raises, if any
+
+    def insert_many(self, docs, ordered=True):
+        assert ordered is False
+        if len(self.batches) == self.fail_at:
+            raise RuntimeError('insert failed')
+        self.batches.append(docs)
+
+
+def iso_input(records, tmp_path, skip=0):
+    iso_path = write_iso(tmp_path / 'input.iso', records)
+    return iso_path, isis2json.iter_iso_records(iso_path, 1, skip)
+
+
+def test_write_mongo_batches(records, tmp_path, monkeypatch):
+    iso_path, input_gen = iso_input(records, tmp_path, 20)
+    collection = Collection()
+    count = isis2json.write_mongo(input_gen, collection, 250, 20, 5, False,
+                                  False, 1, '', '', 20, batch_size=64)
+    assert count == 250
+    assert [len(batch) for batch in collection.batches] == [64, 64, 64, 58]
+    docs = [doc for batch in collection.batches for doc in batch]
+    assert [doc['_id'] for doc in docs] == [str(i) for i in range(20, 270)]
+    # the same records --mongo would write as JSON lines
+    expected = run_main(monkeypatch, tmp_path / 'seq.json', iso_path,
+                        '-m', '-i', '5', '-s', '20', '-q', '250')
+    assert [json.loads(line) for line in expected[0].splitlines()] == docs
+
+
+def test_write_mongo_raises_insert_error(records, tmp_path):
+    _, input_gen = iso_input(records, tmp_path)
+    collection = Collection(fail_at=1)
+    with pytest.raises(RuntimeError, match='insert failed'):
+        isis2json.write_mongo(input_gen, collection, isis2json.DEFAULT_QTY, 0,
+                              0, False, False, 1, '', '', batch_size=10)
+    assert len(collection.batches) == 1  # no more inserts after the error
+
+
+def test_write_mongo_queue_is_bounded(records, tmp_path):
+    _, input_gen = iso_input(records, tmp_path)
+    read = []
+    input_gen = (read.append(record) or record for record in input_gen)
+    release = threading.Event()
+
+    class SlowCollection(Collection):
+        def insert_many(self, docs, ordered=True):
+            release.wait(5)
+            super().insert_many(docs, ordered)
+
+    collection = SlowCollection()
+    writer = threading.Thread(target=isis2json.write_mongo, args=(
+        input_gen, collection, isis2json.DEFAULT_QTY, 0, 0, False, False, 1,
+        '', ''), kwargs={'batch_size': 10})
+    writer.start()
+    try:
+        time.sleep(0.5)
+        # one batch being inserted, a full queue, one batch waiting to go in
+        assert len(read) <= (isis2json.MONGO_QUEUE_BATCHES + 2) * 10
+    finally:
+        release.set()
+        writer.join()
+    assert sum(map(len, collection.batches)) == len(records)
@@ -18,54 +18,264 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
-from struct import unpack
+import itertools
+import mmap
+import os
+from array import array
+from struct import Struct, iter_unpack, unpack
 
-CR =  '\x0D' # \r
-LF =  '\x0A' # \n
-IS1 = '\x1F' # ECMA-48 Unit Separator
-IS2 = '\x1E' # ECMA-48 Record Separator / ISO-2709 field separator
-IS3 = '\x1D' # ECMA-48 Group Separator / ISO-2709 record separator
+CR =  b'\x0D' # \r
+LF =  b'\x0A' # \n
+IS1 = b'\x1F' # ECMA-48 Unit Separator
+IS2 = b'\x1E' # ECMA-48 Record Separator / ISO-2709 field separator
+IS3 = b'\x1D' # ECMA-48 Group Separator / ISO-2709 record separator
 LABEL_LEN = 24
 LABEL_FORMAT = '5s c 4s c c 5s 3s c c c c'
+LABEL_STRUCT = Struct(LABEL_FORMAT)
 TAG_LEN = 3
 DEFAULT_ENCODING = 'ASCII'
 SUBFIELD_DELIMITER = '^'
+BLOCK_SIZE = 2**20 # bytes read at a time from files with line breaks
+INDEX_SUFFIX = '.idx'
+# index file header: magic, ISO file size and modification time, and
+# whether it has line breaks; then the offset of each record, as
+# unsigned 64-bit integers
+INDEX_HEADER = Struct('=4sQd?')
+INDEX_MAGIC = b'ISX1'
 
 class IsoFile(object):
+    ''' Read records from an ISO-2709 file.
+
+    Files without line breaks are memory-mapped, and read() returns
+    slices of the map. Other files are read a block at a time, dropping
+    line breaks from the whole block at once, and read() returns slices
+    of the blocks. Either way, read() returns a memoryview, not a copy.
+
+    Reading all records from the start saves their offsets in an index
+    file next to the ISO file, named like it plus INDEX_SUFFIX. With the
+    index, iso_file[i] seeks to record i, counting from 0, and
+    iso_file[i:j] iterates over records i to j-1 without reading the
+    ones before.
+    '''
 
     def __init__(self, filename, encoding = DEFAULT_ENCODING):
+        self.filename = filename
         self.file = open(filename, 'rb')
         self.encoding = encoding
+        self.map = None
+        self.buffer = memoryview(b'')
+        self.pos = 0 # of the next byte to read in buffer
+        self.eof = False # True when buffer holds the rest of the file
+        # the file from offset base on, with line breaks, for tell();
+        # mark is a position in buffer and the same position in raw
+        self.base = 0
+        self.raw = b''
+        self.mark = (0, 0)
+        self.offsets = None # of each record, once the index is loaded
+        self.recording = None # offsets of the records read so far
+        index_file, line_breaks = self.open_index()
+        if index_file is not None:
+            index_file.close()
+        else:
+            self.recording = array('Q') # save an index after a full pass
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError): # empty file, or not a regular file
+            return
+        if line_breaks is None:
+            # NOTE: our fixtures include files which have no linebreaks,
+            # files with CR-LF linebreaks and files with LF linebreaks
+            line_breaks = self.map.find(LF) >= 0 or self.map.find(CR) >= 0
+        if not line_breaks:
+            self.buffer = memoryview(self.map)
+            self.eof = True
+        else:
+            self.map.close()
+            self.map = None
 
     def __iter__(self):
         return self
 
     def next(self):
-        return IsoRecord(self)
+        if self.recording is not None:
+            self.recording.append(self.tell())
+        try:
+            return IsoRecord(self)
+        except StopIteration:
+            if self.recording is not None:
+                self.recording.pop() # the end of the file
+                self.save_index(self.recording)
+                self.offsets = self.recording
+                self.recording = None
+            raise
 
     __next__ = next # Python 3 compatibility
 
+    def __len__(self):
+        return len(self.load_index())
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError('slice step must be 1')
+            return self.records(start, stop)
+        offsets = self.load_index()
+        self.seek(offsets[key])
+        return IsoRecord(self)
+
+    def records(self, start=0, stop=None):
+        ''' iterate over records from start to stop-1, seeking to start
+        if the index exists, or else reading records before it '''
+        offsets = self.offsets
+        if offsets is None and os.path.exists(self.index_filename()):
+            offsets = self.load_index()
+        if offsets is not None:
+            if start < len(offsets):
+                self.seek(offsets[start])
+            else:
+                return iter(())
+            records = self
+        else:
+            records = itertools.islice(self, start, None)
+        if stop is None:
+            return records
+        return itertools.islice(records, stop - start)
+
     def read(self, size):
-        ''' read and drop all CR and LF characters '''
-        # TODO: this is inneficient but works, patches accepted!
-        # NOTE: our fixtures include files which have no linebreaks,
-        # files with CR-LF linebreaks and files with LF linebreaks
-        chunks = []
-        count = 0
-        while count < size:
-            chunk = self.file.read(size-count)
-            if len(chunk) == 0:
+        ''' return memoryview of the next size bytes, without CR and LF
+        characters; shorter at the end of the file '''
+        if self.pos + size > len(self.buffer) and not self.eof:
+            self.fill(size)
+        chunk = self.buffer[self.pos:self.pos + size]
+        self.pos += len(chunk)
+        return chunk
+
+    def peek(self, size):
+        ''' like read, but the same bytes are read again next time '''
+        chunk = self.read(size)
+        self.pos -= len(chunk)
+        return chunk
+
+    def fill(self, size):
+        ''' read blocks until size bytes follow pos, or the file ends '''
+        # a new buffer: views of the old one may still be in use
+        base = self.tell()
+        raw_blocks = [self.raw[base - self.base:]]
+        blocks = [self.buffer[self.pos:].tobytes()]
+        available = len(blocks[0])
+        while available < size:
+            block = self.file.read(max(BLOCK_SIZE, size - available))
+            if not block:
+                self.eof = True
                 break
-            chunk = chunk.replace(CR+LF,'')
-            if CR in chunk:
-                chunk = chunk.replace(CR,'')
-            if LF in chunk:
-                chunk = chunk.replace(LF,'')
-            count += len(chunk)
-            chunks.append(chunk)
-        return ''.join(chunks)
+            raw_blocks.append(block)
+            block = block.translate(None, CR + LF)
+            blocks.append(block)
+            available += len(block)
+        self.buffer = memoryview(b''.join(blocks))
+        self.pos = 0
+        self.base = base
+        self.raw = b''.join(raw_blocks)
+        self.mark = (0, 0)
+
+    def tell(self):
+        ''' return file offset of the next byte to read '''
+        if self.map is not None:
+            return self.pos
+        pos, raw_pos = self.mark
+        if self.pos < pos:
+            pos, raw_pos = 0, 0
+        # skip as many raw bytes as bytes left to reach self.pos, until
+        # the line breaks among them are made up for
+        missing = self.pos - pos
+        while missing:
+            chunk = self.raw[raw_pos:raw_pos + missing]
+            if not chunk:
+                break
+            raw_pos += len(chunk)
+            missing -= len(chunk) - chunk.count(CR) - chunk.count(LF)
+        while self.raw[raw_pos:raw_pos + 1] in (CR, LF):
+            raw_pos += 1
+        self.mark = (self.pos, raw_pos)
+        return self.base + raw_pos
+
+    def seek(self, offset):
+        ''' go to file offset, as returned by tell '''
+        self.recording = None # offsets would not start from the first record
+        if self.map is not None:
+            self.pos = offset
+            return
+        self.file.seek(offset)
+        self.buffer = memoryview(b'')
+        self.pos = 0
+        self.eof = False
+        self.base = offset
+        self.raw = b''
+        self.mark = (0, 0)
+
+    def index_filename(self):
+        return self.filename + INDEX_SUFFIX
+
+    def open_index(self):
+        ''' return the index file, after its header, and whether the ISO
+        file has line breaks; or None, None if there is no index file
+        made for the current size and modification time of the ISO file '''
+        stat = os.stat(self.filename)
+        try:
+            index_file = open(self.index_filename(), 'rb')
+        except (OSError, IOError):
+            return None, None
+        header = index_file.read(INDEX_HEADER.size)
+        if len(header) == INDEX_HEADER.size:
+            magic, size, mtime, line_breaks = INDEX_HEADER.unpack(header)
+            if (magic, size, mtime) == (INDEX_MAGIC, stat.st_size, stat.st_mtime):
+                return index_file, line_breaks
+        index_file.close()
+        return None, None
+
+    def load_index(self):
+        ''' return offsets of all records, from the index file, or else
+        reading all records to save a new index '''
+        if self.offsets is not None:
+            return self.offsets
+        index_file, _ = self.open_index()
+        if index_file is not None:
+            with index_file:
+                self.offsets = array('Q')
+                self.offsets.frombytes(index_file.read())
+            return self.offsets
+        offsets = array('Q')
+        iso_file = IsoFile(self.filename, self.encoding)
+        iso_file.recording = offsets
+        try:
+            for record in iso_file:
+                pass
+        finally:
+            iso_file.close()
+        self.offsets = offsets # only if every record could be read
+        return offsets
+
+    def save_index(self, offsets):
+        stat = os.fstat(self.file.fileno())
+        header = INDEX_HEADER.pack(INDEX_MAGIC, stat.st_size, stat.st_mtime,
+                                   self.map is None)
+        tmp_filename = '%s.%s.tmp' % (self.index_filename(), os.getpid())
+        try:
+            with open(tmp_filename, 'wb') as index_file:
+                index_file.write(header)
+                offsets.tofile(index_file)
+            os.rename(tmp_filename, self.index_filename())
+        except (OSError, IOError):
+            pass # read-only directory: records are read from the start
 
     def close(self):
+        self.buffer = memoryview(b'')
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                pass # fields still in use keep the map open until dropped
         self.file.close()
 
 class IsoRecord(object):
@@ -73,6 +283,8 @@ class IsoRecord(object):
                         ' base_addr user_defined'
                         # directory map:
                         ' fld_len_len start_len impl_len reserved').split()
+    int_part_names = set(name for name in label_part_names
+                         if name.endswith('_len') or name.endswith('_addr'))
     rec_len = 0
 
     def __init__(self, iso_file=None):
@@ -89,10 +301,10 @@ class IsoRecord(object):
         if len(label) == 0:
             raise StopIteration
         elif len(label) != 24:
-            raise ValueError('Invalid record label: "%s"' % label)
-        parts = unpack(LABEL_FORMAT, label)
+            raise ValueError('Invalid record label: "%s"' % label.tobytes())
+        parts = LABEL_STRUCT.unpack(label)
         for name, part in zip(self.label_part_names, parts):
-            if name.endswith('_len') or name.endswith('_addr'):
+            if name in self.int_part_names:
                 part = int(part)
             setattr(self, name, part)
 
@@ -103,31 +315,48 @@ class IsoRecord(object):
     def load_directory(self):
         fmt_dir = '3s %ss %ss %ss' % (self.fld_len_len, self.start_len, self.impl_len)
         entry_len = TAG_LEN + self.fld_len_len + self.start_len + self.impl_len
+        # the directory ends with a field separator just before base_addr:
+        # if so, unpack all its entries at once
+        dir_len = self.base_addr - LABEL_LEN - 1
+        if dir_len > 0 and dir_len % entry_len == 0:
+            directory = self.iso_file.peek(dir_len + 1).tobytes()
+            # entries start with a digit, as checked one at a time below
+            if directory[-1:] == IS2 and directory[:-1:entry_len].isdigit():
+                self.iso_file.read(dir_len + 1)
+                self.directory = [Field(*entry) for entry in
+                                  iter_unpack(fmt_dir, directory[:-1])]
+                return
         self.directory = []
         while True:
-            char = self.iso_file.read(1)
+            char = self.iso_file.read(1).tobytes()
             if char.isdigit():
-                entry = char + self.iso_file.read(entry_len-1)
+                entry = char + self.iso_file.read(entry_len-1).tobytes()
                 entry = Field(* unpack(fmt_dir, entry))
                 self.directory.append(entry)
             else:
                 break
 
     def load_fields(self):
+        # XXX: lilacs30.iso has an identifier_len == 2,
+        # but we need to ignore it to succesfully read the field contents
+        # TODO: find out when to ignore the idenfier_len,
+        # or fix the lilacs30.iso fixture
+        #
+        ##if self.identifier_len > 0: #
+        ##    field.identifier = self.iso_file.read(self.identifier_len)
+        indicator_len = self.indicator_len
+        size = (indicator_len * len(self.directory) +
+                sum(field.len for field in self.directory))
+        data = self.iso_file.read(size + 1) # with the record separator
+        assert len(data) >= size
+        pos = 0
         for field in self.directory:
-            if self.indicator_len > 0:
-                field.indicator = self.iso_file.read(self.indicator_len)
-            # XXX: lilacs30.iso has an identifier_len == 2,
-            # but we need to ignore it to succesfully read the field contents
-            # TODO: find out when to ignore the idenfier_len,
-            # or fix the lilacs30.iso fixture
-            #
-            ##if self.identifier_len > 0: #
-            ##    field.identifier = self.iso_file.read(self.identifier_len)
-            value = self.iso_file.read(len(field))
-            assert len(value) == len(field)
-            field.value = value[:-1] # remove trailing field separator
-        self.iso_file.read(1) # discard record separator
+            if indicator_len > 0:
+                field.indicator = data[pos:pos + indicator_len]
+                pos += indicator_len
+            end = pos + field.len
+            field.value = data[pos:end - 1] # remove trailing field separator
+            pos = end
 
     def __iter__(self):
         return self
@@ -140,7 +369,7 @@ class IsoRecord(object):
 
     def dump(self):
         for field in self.directory:
-            print('%3s %r' % (field.tag, field.value))
+            print('%3s %r' % (field.tag, field.value.tobytes()))
 
 class Field(object):
 
@@ -0,0 +1,161 @@
+import os
+import random
+
+import pytest
+
+import iso2709
+from iso2709 import IS2, IS3, IsoFile
+
+WORDS = ['alpha', 'beta', 'Gama', 'delta', 'São Paulo', 'ação', 'x']
+LINE_BREAKS = {'plain': b'', 'lf': b'\n', 'crlf': b'\r\n'}
+LINE_WIDTH = 80  # as in ISO files exported by CDS/ISIS
+
+
+def make_record(fields):
+    values = [value + IS2 for tag, value in fields]
+    directory = b''
+    start = 0
+    for (tag, _), value in zip(fields, values):
+        directory += b'%03d%04d%05d' % (tag, len(value), start)
+        start += len(value)
+    base_addr = iso2709.LABEL_LEN + len(directory) + 1
+    rec_len = base_addr + start + 1
+    label = b'%05dn    00%05d   4500' % (rec_len, base_addr)
+    return label + directory + IS2 + b''.join(values) + IS3
+
+
+def random_fields(rnd):
+    fields = []
+    for _ in range(rnd.randint(1, 12)):
+        words = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(0, 12)))
+        if rnd.random() < 0.5:
+            words += '^a' + rnd.choice(WORDS) + '^b' + rnd.choice(WORDS)
+        fields.append((rnd.choice([1, 10, 30, 65, 999]), words.encode('cp1252')))
+    return fields
+
+
+def write_iso(path, records, line_break=b''):
+    """Write records, lists of (tag, value) pairs, breaking lines as
+    ISO exports do, every LINE_WIDTH bytes"""
+    data = b''.join(make_record(fields) for fields in records)
+    if line_break:
+        data = line_break.join(data[i:i + LINE_WIDTH]
+                               for i in range(0, len(data), LINE_WIDTH)) + line_break
+    path.write_bytes(data)
+    return str(path)
+
+
+@pytest.fixture(scope='module')
+def records():
+    rnd = random.Random(2709)
+    return [random_fields(rnd) for _ in range(300)]
+
+
+@pytest.fixture(params=LINE_BREAKS)
+def iso_path(request, records, tmp_path):
+    path = tmp_path / f'{request.param}.iso'
+    return write_iso(path, records, LINE_BREAKS[request.param])
+
+
+def read_fields(record):
+    return [(int(field.tag), field.value.tobytes()) for field in record.directory]
+
+
+def test_records_match_fields_written(records, iso_path):
+    iso_file = IsoFile(iso_path)
+    assert [read_fields(record) for record in iso_file] == records
+    iso_file.close()
+
+
+def test_only_plain_file_is_mapped(iso_path):
+    iso_file = IsoFile(iso_path)
+    assert (iso_file.map is not None) == iso_path.endswith('plain.iso')
+    iso_file.close()
+
+
+@pytest.mark.parametrize('block_size', [1, 7, 100, 4096])
+def test_small_blocks_match_mmap(records, tmp_path, monkeypatch, block_size):
+    # records and line breaks straddle block boundaries
+    plain = IsoFile(write_iso(tmp_path / 'plain.iso', records))
+    expected = [read_fields(record) for record in plain]
+    plain.close()
+    monkeypatch.setattr(iso2709, 'BLOCK_SIZE', block_size)
+    wrapped = IsoFile(write_iso(tmp_path / 'crlf.iso', records, b'\r\n'))
+    assert wrapped.map is None
+    assert [read_fields(record) for record in wrapped] == expected
+    wrapped.close()
+
+
+def read_all(path):
+    iso_file = IsoFile(path)
+    fields = [read_fields(record) for record in iso_file]
+    iso_file.close()
+    return fields
+
+
+@pytest.mark.parametrize('block_size', [7, iso2709.BLOCK_SIZE])
+def test_index_random_access(records, iso_path, monkeypatch, block_size):
+    # small blocks exercise tell(), mapping buffer positions back to file
+    # offsets across many refills
+    monkeypatch.setattr(iso2709, 'BLOCK_SIZE', block_size)
+    assert read_all(iso_path) == records  # a full pass saves the index
+    index_path = iso_path + iso2709.INDEX_SUFFIX
+    with open(index_path, 'rb') as index_file:
+        assert index_file.read(4) == iso2709.INDEX_MAGIC
+    iso_file = IsoFile(iso_path)
+    assert len(iso_file) == len(records)
+    order = list(range(len(records)))
+    random.Random(22).shuffle(order)
+    for i in order + [-1]:
+        assert read_fields(iso_file[i]) == records[i]
+    assert [read_fields(r) for r in iso_file[100:110]] == records[100:110]
+    assert [read_fields(r) for r in iso_file.records(295)] == records[295:]
+    assert [read_fields(r) for r in iso_file.records(7, 9)] == records[7:9]
+    assert list(iso_file.records(len(records))) == []
+    iso_file.close()
+
+
+def test_index_built_on_demand(records, iso_path):
+    iso_file = IsoFile(iso_path)
+    assert read_fields(iso_file[150]) == records[150]
+    iso_file.close()
+    iso_file = IsoFile(iso_path)
+    assert iso_file.recording is None  # the index was saved
+    assert [read_fields(r) for r in iso_file.records(290, 293)] == records[290:293]
+    iso_file.close()
+
+
+def test_records_without_index(records, iso_path):
+    iso_file = IsoFile(iso_path)
+    assert [read_fields(r) for r in iso_file.records(10, 13)] == records[10:13]
+    iso_file.close()
+
+
+@pytest.mark.parametrize('line_break', LINE_BREAKS.values())
+def test_stale_index_is_rebuilt(records, tmp_path, line_break):
+    path = write_iso(tmp_path / 'stale.iso', records, line_break)
+    read_all(path)
+    stat = os.stat(path)
+    # same size, other offsets: only the modification time tells
+    changed = records[::-1]
+    write_iso(tmp_path / 'stale.iso', changed, line_break)
+    assert os.stat(path).st_size == stat.st_size
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    iso_file = IsoFile(path)
+    assert iso_file.recording is not None  # the old index was not trusted
+    assert read_fields(iso_file[0]) == changed[0]
+    assert [read_fields(r) for r in iso_file.records(200, 203)] == changed[200:203]
+    iso_file.close()
+
+
+def test_unreadable_file_not_indexed(records, tmp_path):
+    path = write_iso(tmp_path / 'truncated.iso', records)
+    with open(path, 'r+b') as iso_file:
+        # inside the label of record 150
+        iso_file.truncate(sum(len(make_record(fields)) for fields in records[:150]) + 10)
+    iso_file = IsoFile(path)
+    with pytest.raises(ValueError, match='Invalid record label'):
+        len(iso_file)
+    assert iso_file.offsets is None
+    iso_file.close()
+    assert not os.path.exists(path + iso2709.INDEX_SUFFIX)
@@ -26,30 +26,36 @@ MAIN_SUBFIELD_KEY = '_'
 SUBFIELD_MARKER_RE = re.compile(r'\^([a-z0-9])', re.IGNORECASE)
 DEFAULT_ENCODING = u'utf-8'
 
+SUBKEY_REGEXES = {None: SUBFIELD_MARKER_RE} # compiled once per subkeys
+
 def expand(content, subkeys=None):
     ''' Parse a field into an association list of keys and subfields
 
         >>> expand('zero^1one^2two^3three')
         [('_', 'zero'), ('1', 'one'), ('2', 'two'), ('3', 'three')]
+        >>> expand('zero^1one^2two^3three', subkeys='13')
+        [('_', 'zero'), ('1', 'one^2two'), ('3', 'three')]
+        >>> expand('caret^^aescaped ^Bsubfield ')
+        [('_', 'caret^^ aescaped'), ('b', 'subfield')]
 
     '''
-    if subkeys is None:
-        regex = SUBFIELD_MARKER_RE
-    elif subkeys == '':
-        return [(MAIN_SUBFIELD_KEY, content)]
-    else:
+    try:
+        regex = SUBKEY_REGEXES[subkeys]
+    except KeyError:
+        if subkeys == '':
+            return [(MAIN_SUBFIELD_KEY, content)]
         regex = re.compile(r'\^(['+subkeys+'])', re.IGNORECASE)
-    content = content.replace('^^', '^^ ')
-    parts = []
-    start = 0
-    key = MAIN_SUBFIELD_KEY
-    while True:
-        found = regex.search(content, start)
-        if found is None: break
-        parts.append((key, content[start:found.start()].rstrip()))
-        key = found.group(1).lower()
-        start = found.end()
-    parts.append((key, content[start:].rstrip()))
+        SUBKEY_REGEXES[subkeys] = regex
+    if '^^' in content:
+        content = content.replace('^^', '^^ ')
+    # split returns the main subfield, then each key and its subfield
+    pieces = regex.split(content)
+    parts = [(MAIN_SUBFIELD_KEY, pieces[0].rstrip())]
+    if len(pieces) > 1:
+        pieces = iter(pieces)
+        next(pieces)
+        parts.extend((key.lower(), subfield.rstrip())
+                     for key, subfield in zip(pieces, pieces))
     return parts
 
 
@@ -68,20 +74,26 @@ class CompositeString(object):
             raise TypeError('%r value must be unicode or str instance' % isis_raw)
 
         self.__isis_raw = isis_raw.decode(encoding)
-        self.__expanded = expand(self.__isis_raw, subkeys)
+        self.__subkeys = subkeys
+        self.__expanded = None # on first access to the subfields
+
+    def __subfields(self):
+        if self.__expanded is None:
+            self.__expanded = expand(self.__isis_raw, self.__subkeys)
+        return self.__expanded
 
     def __getitem__(self, key):
-        for subfield in self.__expanded:
+        for subfield in self.__subfields():
             if subfield[0] == key:
                 return subfield[1]
         else:
             raise KeyError(key)
 
     def __iter__(self):
-        return (subfield[0] for subfield in self.__expanded)
+        return (subfield[0] for subfield in self.__subfields())
 
     def items(self):
-        return self.__expanded
+        return self.__subfields()
 
     def __unicode__(self):
         return self.__isis_raw
@@ -128,7 +128,9 @@ SyntaxError: (lambda is not like this)
 
 import math
 
-from lis import run
+from pytest import mark
+
+from lis import run, evaluate_compiled, evaluate_iterative
 
 
 fact_src = """
@@ -257,3 +259,24 @@ def test_closure_averager():
     got = run(closure_averager_src)
     assert got == 12.0
 # end::RUN_AVERAGER[]
+
+
+############################################ same programs, other evaluators
+all_examples = [
+    fact_src,
+    gcd_src,
+    quicksort_src,
+    newton_src,
+    closure_src,
+    closure_with_change_src,
+    closure_averager_src,
+]
+
+@mark.parametrize('evaluator', [evaluate_compiled, evaluate_iterative])
+@mark.parametrize('source', all_examples)
+def test_same_as_evaluate(source, evaluator, capsys):
+    expected = run(source)
+    expected_out = capsys.readouterr().out
+    got = run(source, evaluator)
+    assert got == expected
+    assert capsys.readouterr().out == expected_out
@@ -12,9 +12,10 @@
 # tag::IMPORTS[]
 import math
 import operator as op
+import re
 from collections import ChainMap
 from itertools import chain
-from typing import Any, TypeAlias, NoReturn
+from typing import Any, Callable, Iterable, Iterator, TypeAlias, TextIO, NoReturn
 
 Symbol: TypeAlias = str
 Atom: TypeAlias = float | int | Symbol
@@ -28,25 +29,40 @@ def parse(program: str) -> Expression:
     "Read a Scheme expression from a string."
     return read_from_tokens(tokenize(program))
 
-def tokenize(s: str) -> list[str]:
-    "Convert a string into a list of tokens."
-    return s.replace('(', ' ( ').replace(')', ' ) ').split()
+TOKEN_RE = re.compile(r'[()]|[^\s()]+')
 
-def read_from_tokens(tokens: list[str]) -> Expression:
+def tokenize(s: str) -> Iterator[str]:
+    "Yield the tokens in a string, one at a time."
+    return (match.group() for match in TOKEN_RE.finditer(s))
+
+def tokenize_lines(lines: Iterable[str]) -> Iterator[str]:
+    "Yield the tokens in a file, or any iterable of lines, one at a time."
+    for line in lines:
+        yield from tokenize(line)
+
+def read_from_tokens(tokens: Iterable[str]) -> Expression:
     "Read an expression from a sequence of tokens."
-    if len(tokens) == 0:
-        raise SyntaxError('unexpected EOF while reading')
-    token = tokens.pop(0)
-    if '(' == token:
-        exp = []
-        while tokens[0] != ')':
-            exp.append(read_from_tokens(tokens))
-        tokens.pop(0)  # discard ')'
-        return exp
-    elif ')' == token:
-        raise SyntaxError('unexpected )')
-    else:
-        return parse_atom(token)
+    stack: list[list] = []  # lists still open, innermost last
+    for token in tokens:
+        if '(' == token:
+            stack.append([])
+            continue
+        elif ')' == token:
+            if not stack:
+                raise SyntaxError('unexpected )')
+            exp = stack.pop()
+        else:
+            exp = parse_atom(token)
+        if not stack:
+            return exp
+        stack[-1].append(exp)
+    raise SyntaxError('unexpected EOF while reading')
+
+def read_all(tokens: Iterable[str]) -> Iterator[Expression]:
+    "Yield each expression in a sequence of tokens, until they run out."
+    tokens = iter(tokens)
+    for token in tokens:
+        yield read_from_tokens(chain([token], tokens))
 
 def parse_atom(token: str) -> Atom:
     "Numbers become numbers; every other token is a symbol."
@@ -192,20 +208,323 @@ class Procedure:
 # end::PROCEDURE[]
 
 
+################ Iterative evaluator: explicit stack, proper tail calls
+
+# `evaluate_iterative` handles the same cases as `evaluate`, but never
+# recurses in Python. Work still to do after a subexpression is evaluated
+# goes on an explicit stack of continuations, which lives on the heap.
+# The branches of `if` and the last expression of a procedure body are in
+# tail position: they are evaluated without pushing a continuation, so a
+# tail call reuses the caller's place on the stack, like Norvig's
+# `lispy.py`. Tail-recursive loops run in constant stack and memory.
+#
+# Continuations are tuples tagged with the step they resume:
+#   ('if', consequence, alternative, env)
+#   ('define', name, env)
+#   ('set!', name, env)
+#   ('call', exps, values, env): operator and operands, values so far
+#   ('body', exps, index, env): rest of a procedure body
+
+def evaluate_iterative(exp: Expression, env: Environment) -> Any:
+    "Evaluate an expression with an explicit stack and proper tail calls."
+    stack: list[tuple] = []
+    while True:
+        match exp:
+            case int(x) | float(x):
+                value = x
+            case Symbol(var):
+                value = env[var]
+            case ['quote', x]:
+                value = x
+            case ['if', test, consequence, alternative]:
+                stack.append(('if', consequence, alternative, env))
+                exp = test
+                continue
+            case ['lambda', [*parms], *body] if body:
+                value = Procedure(parms, body, env)
+            case ['define', Symbol(name), value_exp]:
+                stack.append(('define', name, env))
+                exp = value_exp
+                continue
+            case ['define', [Symbol(name), *parms], *body] if body:
+                env[name] = Procedure(parms, body, env)
+                value = None
+            case ['set!', Symbol(name), value_exp]:
+                stack.append(('set!', name, env))
+                exp = value_exp
+                continue
+            case [func_exp, *args] if func_exp not in KEYWORDS:
+                stack.append(('call', exp, [], env))
+                exp = func_exp
+                continue
+            case _:
+                raise SyntaxError(lispstr(exp))
+
+        # Pass the value to pending continuations until one of them
+        # has another expression to evaluate.
+        while True:
+            if not stack:
+                return value
+            match stack.pop():
+                case ('if', consequence, alternative, env):
+                    exp = consequence if value else alternative
+                    break
+                case ('define', name, env):
+                    env[name] = value
+                    value = None
+                case ('set!', name, env):
+                    env.change(name, value)
+                    value = None
+                case ('call', exps, values, env) as frame:
+                    values.append(value)
+                    if len(values) < len(exps):
+                        stack.append(frame)
+                        exp = exps[len(values)]
+                        break
+                    proc, *args = values
+                    if not isinstance(proc, Procedure):
+                        value = proc(*args)
+                        continue
+                    env = Environment(dict(zip(proc.parms, args)), proc.env)
+                    exp, *rest = proc.body
+                    if rest:
+                        stack.append(('body', proc.body, 1, env))
+                    break
+                case ('body', exps, index, env):
+                    exp = exps[index]
+                    if index + 1 < len(exps):
+                        stack.append(('body', exps, index + 1, env))
+                    break
+
+
+################ Compiler: closures instead of pattern matching
+
+# `compile_exp` walks an expression once, running the same `match` as
+# `evaluate`, and returns a closure that does the work of that case.
+# Running the closure never matches patterns again, which pays off when
+# procedure bodies run many times.
+#
+# Variables are resolved at compile time too. Each procedure call gets one
+# `Frame`: a list holding the parent frame in slot 0, then the arguments,
+# then the names the body defines. A local variable compiles to a fixed
+# (depth, index) address: go up `depth` parents, then read slot `index`.
+# Any other name is global, looked up in the `Environment` at the root of
+# the frame chain, which is where top-level code runs.
+
+Frame: TypeAlias = list  # [parent frame or global env, slot 1, slot 2, ...]
+Code: TypeAlias = Callable[[Any], Any]  # takes a Frame, or the global env
+
+class Unbound:
+    "Marks a slot for a name the body defines, before its `define` runs."
+
+UNBOUND = Unbound()
+
+class Scope:
+    "Compile-time layout of a frame: the slot of each local name."
+
+    def __init__(self, names: list[Symbol], defined: list[Symbol], parent: 'Scope | None'):
+        self.slots = {name: index for index, name in enumerate(names + defined, 1)}
+        self.defined = set(defined)
+        self.parent = parent
+        self.depth = 1 if parent is None else parent.depth + 1
+
+def resolve(scope: Scope | None, name: Symbol) -> tuple[int, int] | None:
+    "Find the (depth, index) address of a local variable; None if global."
+    depth = 0
+    while scope is not None:
+        if name in scope.slots:
+            return depth, scope.slots[name]
+        scope = scope.parent
+        depth += 1
+    return None
+
+def defined_names(body: list[Expression]) -> list[Symbol]:
+    "Names the body defines outside nested lambdas: locals of its frame."
+    names: dict[Symbol, None] = {}
+    def scan(exp: Expression) -> None:
+        match exp:
+            case ['quote', _] | ['lambda', *_]:
+                pass
+            case ['define', Symbol(name), value_exp]:
+                names[name] = None
+                scan(value_exp)
+            case ['define', [Symbol(name), *_], *_]:
+                names[name] = None
+            case [*items]:
+                for item in items:
+                    scan(item)
+    for exp in body:
+        scan(exp)
+    return list(names)
+
+def up(frame: Any, depth: int) -> Any:
+    "Follow `depth` parent links from a frame."
+    for _ in range(depth):
+        frame = frame[0]
+    return frame
+
+def compile_exp(exp: Expression, scope: Scope | None = None) -> Code:
+    "Compile an expression into a closure taking a frame."
+    match exp:
+        case int(x) | float(x):
+            return lambda frame: x
+        case Symbol(var):
+            return compile_ref(var, scope)
+        case ['quote', x]:
+            return lambda frame: x
+        case ['if', test, consequence, alternative]:
+            test_code = compile_exp(test, scope)
+            consequence_code = compile_exp(consequence, scope)
+            alternative_code = compile_exp(alternative, scope)
+            def if_code(frame: Any) -> Any:
+                if test_code(frame):
+                    return consequence_code(frame)
+                else:
+                    return alternative_code(frame)
+            return if_code
+        case ['lambda', [*parms], *body] if body:
+            return compile_lambda(parms, body, scope)
+        case ['define', Symbol(name), value_exp]:
+            return compile_define(name, compile_exp(value_exp, scope), scope)
+        case ['define', [Symbol(name), *parms], *body] if body:
+            return compile_define(name, compile_lambda(parms, body, scope), scope)
+        case ['set!', Symbol(name), value_exp]:
+            return compile_set(name, compile_exp(value_exp, scope), scope)
+        case [func_exp, *args] if func_exp not in KEYWORDS:
+            func_code = compile_exp(func_exp, scope)
+            return compile_call(func_code, [compile_exp(arg, scope) for arg in args])
+        case _:
+            raise SyntaxError(lispstr(exp))
+
+def compile_ref(name: Symbol, scope: Scope | None) -> Code:
+    "Compile a variable reference to a slot read, or a global lookup."
+    match resolve(scope, name):
+        case (0, index) if name not in scope.defined:  # type: ignore[union-attr]
+            return lambda frame: frame[index]
+        case (1, index) if name not in scope.parent.defined:  # type: ignore[union-attr]
+            return lambda frame: frame[0][index]
+        case (depth, index):
+            def local_code(frame: Any) -> Any:
+                value = up(frame, depth)[index]
+                if value is UNBOUND:
+                    raise KeyError(name)
+                return value
+            return local_code
+        case None if scope is None:
+            return lambda env: env[name]
+        case None if scope.depth == 1:
+            return lambda frame: frame[0][name]
+        case None:
+            depth = scope.depth
+            return lambda frame: up(frame, depth)[name]
+
+def compile_define(name: Symbol, value_code: Code, scope: Scope | None) -> Code:
+    "Compile a define: a global in top-level code, a local slot otherwise."
+    if scope is None:
+        def define_global(env: Environment) -> None:
+            env[name] = value_code(env)
+        return define_global
+    index = scope.slots[name]
+    def define_local(frame: Frame) -> None:
+        frame[index] = value_code(frame)
+    return define_local
+
+def compile_set(name: Symbol, value_code: Code, scope: Scope | None) -> Code:
+    "Compile a set!: write the variable's slot, or change a global."
+    match resolve(scope, name):
+        case (depth, index):
+            def set_local(frame: Frame) -> None:
+                up(frame, depth)[index] = value_code(frame)
+            return set_local
+        case None:
+            depth = 0 if scope is None else scope.depth
+            def set_global(frame: Any) -> None:
+                up(frame, depth).change(name, value_code(frame))
+            return set_global
+
+def compile_lambda(parms: list[Symbol], body: list[Expression], scope: Scope | None) -> Code:
+    "Compile a lambda; the closure makes a procedure over the current frame."
+    defined = [name for name in defined_names(body) if name not in parms]
+    body_code = compile_body(body, Scope(parms, defined, scope))
+    arity = len(parms)
+    padding = [UNBOUND] * len(defined)
+    return lambda frame: CompiledProcedure(body_code, arity, padding, frame)
+
+def compile_body(body: list[Expression], scope: Scope | None) -> Code:
+    "Compile a sequence of expressions; the closure returns the last value."
+    codes = [compile_exp(exp, scope) for exp in body]
+    if len(codes) == 1:
+        return codes[0]
+    *init, last = codes
+    def body_code(frame: Any) -> Any:
+        for code in init:
+            code(frame)
+        return last(frame)
+    return body_code
+
+def compile_call(func_code: Code, arg_codes: list[Code]) -> Code:
+    "Compile a procedure call, unrolling the common arities."
+    match arg_codes:
+        case []:
+            return lambda frame: func_code(frame)()
+        case [a]:
+            return lambda frame: func_code(frame)(a(frame))
+        case [a, b]:
+            return lambda frame: func_code(frame)(a(frame), b(frame))
+        case [a, b, c]:
+            return lambda frame: func_code(frame)(a(frame), b(frame), c(frame))
+        case _:
+            return lambda frame: func_code(frame)(*[code(frame) for code in arg_codes])
+
+class CompiledProcedure:
+    "A user-defined Scheme procedure with a compiled body."
+
+    __slots__ = ('body', 'arity', 'padding', 'frame')
+
+    def __init__(self, body: Code, arity: int, padding: list[Unbound], frame: Any):
+        self.body = body
+        self.arity = arity
+        self.padding = padding
+        self.frame = frame
+
+    def __call__(self, *args: Any) -> Any:
+        if len(args) != self.arity:
+            raise TypeError(f'expected {self.arity} arguments, got {len(args)}')
+        return self.body([self.frame, *args, *self.padding])
+
+def evaluate_compiled(exp: Expression, env: Environment) -> Any:
+    "Compile an expression, then run it in an environment."
+    return compile_exp(exp)(env)
+
+
 ################ command-line interface
 
-def run(source: str) -> Any:
+def run(source: str | TextIO, evaluator: Callable[[Expression, Environment], Any] = evaluate) -> Any:
+    "Evaluate each expression in a string or open file, returning the last value."
     global_env = Environment({}, standard_env())
-    tokens = tokenize(source)
-    while tokens:
-        exp = read_from_tokens(tokens)
-        result = evaluate(exp, global_env)
+    if isinstance(source, str):
+        tokens = tokenize(source)
+    else:
+        tokens = tokenize_lines(source)
+    result = None
+    for exp in read_all(tokens):
+        result = evaluator(exp, global_env)
     return result
 
+EVALUATOR_OPTIONS = {
+    '--compile': evaluate_compiled,
+    '--iterative': evaluate_iterative,
+}
+
 def main(args: list[str]) -> None:
+    evaluator = evaluate
+    for option, alternative in EVALUATOR_OPTIONS.items():
+        if option in args:
+            args.remove(option)
+            evaluator = alternative
     if len(args) == 1:
         with open(args[0]) as fp:
-            run(fp.read())
+            run(fp, evaluator)
     else:
         repl()
 
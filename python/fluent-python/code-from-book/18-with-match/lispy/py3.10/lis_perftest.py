@@ -0,0 +1,100 @@
+"""
+Evaluator performance test: recursive ``fib`` and ``fact``, nested closures,
+and a tail-recursive loop, which only ``evaluate_iterative`` can run to
+completion: peak memory should not grow with the number of iterations.
+
+Also times the reader on programs of growing size: time should grow
+linearly, and peak memory should not grow at all.
+"""
+import io
+import sys
+import timeit
+import tracemalloc
+
+from lis import evaluate, evaluate_compiled, evaluate_iterative, run
+from lis import read_all, tokenize_lines
+
+PROGRAMS = {
+    'fib': """
+        (define (fib n)
+            (if (< n 2)
+                n
+                (+ (fib (- n 1)) (fib (- n 2)))))
+        (fib {n})
+    """,
+    'fact': """
+        (define (fact n)
+            (if (< n 2)
+                1
+                (* n (fact (- n 1)))))
+        (fact {n})
+    """,
+    'nested': """
+        (define (adder a)
+            (lambda (b)
+                (lambda (c)
+                    (lambda (d) (+ a (+ b (+ c d)))))))
+        (define (sum n total)
+            (if (= n 0)
+                total
+                (sum (- n 1) ((((adder n) 1) 2) total))))
+        (sum {n} 0)
+    """,
+    'loop': """
+        (define (loop n acc)
+            (if (= n 0)
+                acc
+                (loop (- n 1) (+ acc 1))))
+        (loop {n} 0)
+    """,
+}
+
+EVALUATORS = {
+    'evaluate': evaluate,
+    'compiled': evaluate_compiled,
+    'iterative': evaluate_iterative,
+}
+
+def peak_memory(source, evaluator):
+    tracemalloc.start()
+    run(source, evaluator)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+def test(name, n, number, repeat, evaluators=EVALUATORS):
+    source = PROGRAMS[name].format(n=n)
+    print(f'{name} {n} x {number}')
+    baseline = None
+    for label, evaluator in evaluators.items():
+        tt = timeit.repeat(lambda: run(source, evaluator), repeat=repeat, number=number)
+        best = min(tt)
+        if baseline is None:
+            baseline = best
+        peak = peak_memory(source, evaluator)
+        print(f'|{label:>10}|{best:10.4f}s|{baseline / best:6.2f}x|{peak / 1024:8.0f} KiB peak')
+
+def read(lines):
+    for _ in read_all(tokenize_lines(lines)):
+        pass
+
+def test_read(n):
+    source = '(define (double n) (* n 2.0))\n' * n
+    print(f'read {len(source) / 2**20:.1f} MiB, {n} expressions')
+    elapsed = timeit.timeit(lambda: read(io.StringIO(source)), number=1)
+    lines = io.StringIO(source)  # created before tracing: the file is not counted
+    tracemalloc.start()
+    read(lines)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'|{elapsed:10.4f}s|{elapsed / n * 1e6:6.2f}us/exp|{peak / 1024:8.0f} KiB peak')
+
+if __name__ == '__main__':
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    test('fib', 20, 1, repeat)
+    test('fact', 100, 100, repeat)
+    test('nested', 100, 100, repeat)
+    for exponent in range(4, 7):
+        test('loop', 10**exponent, 1, 1, {'iterative': evaluate_iterative})
+    for exponent in range(3, 6):
+        test_read(10**exponent)
@@ -1,8 +1,11 @@
+import io
 from typing import Optional
 
-from pytest import mark, fixture
+from pytest import mark, fixture, raises
 
 from lis import parse, evaluate, Expression, Environment, standard_env
+from lis import tokenize, tokenize_lines, read_all, run
+from lis import compile_exp, defined_names, evaluate_compiled, evaluate_iterative
 
 ############################################################# tests for parse
 
@@ -19,6 +22,34 @@ def test_parse(source: str, expected: Expression) -> None:
     assert got == expected
 
 
+@mark.parametrize( 'source', [
+    '',
+    '(a (b)',
+    ')',
+])
+def test_parse_syntax_error(source: str) -> None:
+    with raises(SyntaxError):
+        parse(source)
+
+
+def test_tokenize_is_lazy() -> None:
+    tokens = tokenize('(define x 1) (oops')
+    assert next(tokens) == '('
+    assert list(tokens) == ['define', 'x', '1', ')', '(', 'oops']
+
+
+def test_tokenize_lines() -> None:
+    lines = ['(define (double n)\n', '    (* n 2))\n', '(double 21)\n']
+    got = list(read_all(tokenize_lines(lines)))
+    assert got == [['define', ['double', 'n'], ['*', 'n', 2]], ['double', 21]]
+
+
+def test_run_file() -> None:
+    source = '(define (double n) (* n 2))\n(double\n 21)\n'
+    assert run(io.StringIO(source)) == 42
+    assert run(source) == 42
+
+
 ########################################################## tests for evaluate
 
 # Norvig's tests are not isolated: they assume the
@@ -178,3 +209,93 @@ def test_define_function(std_env: Environment) -> None:
     assert max_fn.env is std_env
     assert max_fn(1, 2) == 2
     assert max_fn(3, 2) == 3
+
+
+##################################################### tests for compile_exp
+
+def test_defined_names() -> None:
+    body = [parse('(define n 0)'),
+            parse('(define (inc) (define step 1) (set! n (+ n step)))'),
+            parse('(lambda () (define hidden 2) hidden)')]
+    assert defined_names(body) == ['n', 'inc']
+
+
+def test_compiled_nested_closures(std_env: Environment) -> None:
+    source = """
+        (define (adder a)
+            (lambda (b)
+                (lambda (c)
+                    (lambda (d) (list a b c d)))))
+        """
+    evaluate_compiled(parse(source), std_env)
+    got = evaluate_compiled(parse('((((adder 1) 2) 3) 4)'), std_env)
+    assert got == [1, 2, 3, 4]
+
+
+def test_compiled_set_outer_local(std_env: Environment) -> None:
+    source = """
+        (define (make-counter)
+            (define n 0)
+            (lambda ()
+                ((lambda () (set! n (+ n 1))))
+                n))
+        """
+    evaluate_compiled(parse(source), std_env)
+    counter = evaluate_compiled(parse('(make-counter)'), std_env)
+    assert [counter(), counter(), counter()] == [1, 2, 3]
+
+
+def test_compiled_set_global(std_env: Environment) -> None:
+    evaluate_compiled(parse('(define total 0)'), std_env)
+    evaluate_compiled(parse('((lambda (x) (set! total x)) 7)'), std_env)
+    assert std_env['total'] == 7
+
+
+def test_compiled_unbound_local(std_env: Environment) -> None:
+    source = '((lambda () (if 0 (define x 1) 0) x))'
+    with raises(KeyError):
+        evaluate_compiled(parse(source), std_env)
+
+
+def test_compiled_arity(std_env: Environment) -> None:
+    proc = evaluate_compiled(parse('(lambda (a b) a)'), std_env)
+    with raises(TypeError):
+        proc(1)
+
+
+def test_compiled_syntax_error() -> None:
+    with raises(SyntaxError):
+        compile_exp(parse('(lambda is not like this)'))
+
+
+############################################## tests for evaluate_iterative
+
+@mark.parametrize( 'source, expected', [
+    ('(quote (1 2))', [1, 2]),
+    ('(if (> 2 1) (quote yes) no-such-thing)', 'yes'),
+    ('((lambda (a b) (define c (* a b)) (+ c 1)) 6 7)', 43),
+    ('(begin (define x 1) (set! x (+ x 1)) x)', 2),
+    ('(map (lambda (x) (* x x)) (list 1 2 3))', [1, 4, 9]),
+])
+def test_evaluate_iterative(std_env: Environment, source: str, expected: Expression) -> None:
+    got = evaluate_iterative(parse(source), std_env)
+    assert got == expected
+
+
+def test_evaluate_iterative_tail_calls(std_env: Environment) -> None:
+    source = """
+        (define (loop n acc)
+            (if (= n 0)
+                acc
+                (loop (- n 1) (+ acc 1))))
+        """
+    evaluate_iterative(parse(source), std_env)
+    got = evaluate_iterative(parse('(loop 10000 0)'), std_env)
+    assert got == 10000
+
+
+def test_evaluate_iterative_deep_recursion(std_env: Environment) -> None:
+    source = '(define (count n) (if (= n 0) 0 (+ 1 (count (- n 1)))))'
+    evaluate_iterative(parse(source), std_env)
+    got = evaluate_iterative(parse('(count 5000)'), std_env)
+    assert got == 5000
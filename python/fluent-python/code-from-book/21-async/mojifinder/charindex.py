@@ -8,36 +8,179 @@ Optional arguments to the constructor are ``first`` and ``last+1``
 character codes to index, to make testing easier. In the examples
 below, only the ASCII range was indexed.
 
-The `entries` attribute is a `defaultdict` with uppercased single
-words as keys::
+The `entries` attribute is a `dict` with uppercased single words as
+keys. Each value is a postings list: the character codes of the
+characters with that word in their names, as an ascending `array`::
 
     >>> idx = InvertedIndex(32, 128)
     >>> idx.entries['DOLLAR']
-    {'$'}
-    >>> sorted(idx.entries['SIGN'])
+    array('I', [36])
+    >>> [chr(code) for code in idx.entries['SIGN']]
     ['#', '$', '%', '+', '<', '=', '>']
-    >>> idx.entries['A'] & idx.entries['SMALL']
-    {'a'}
-    >>> idx.entries['BRILLIG']
-    set()
+    >>> 'BRILLIG' in idx.entries
+    False
 
 The `.search()` method takes a string, uppercases it, splits it into
 words, and returns the intersection of the entries for each word::
 
     >>> idx.search('capital a')
     {'A'}
+    >>> idx.search('small a')
+    {'a'}
+    >>> idx.search('brillig')
+    set()
+
+Postings lists are intersected starting from the shortest one, and
+``intersect_pair`` gallops through much longer ones, so a rare word makes
+a query with common words cheap::
+
+    >>> intersect_pair([3, 4, 11], range(1, 100, 2))
+    [3, 11]
+
+For search-as-you-type, ``prefix=True`` matches the last word of the
+query as a prefix, and ``fuzzy=True`` replaces words not in the index
+with those one typo away: one letter deleted, inserted, replaced, or
+two adjacent letters swapped::
+
+    >>> idx.search('dol', prefix=True)
+    {'$'}
+    >>> idx.words_with_prefix('PAR')
+    ['PARENTHESIS']
+    >>> idx.search('dolar', fuzzy=True)
+    {'$'}
+    >>> idx.similar_words('SIGM')
+    ['SIGN']
+
+``.rank()`` returns sort keys for the best results, with the code last:
+characters with more query words in their names come first, then those
+with shorter names. Passing the last key as ``after`` gets the next page::
+
+    >>> page = idx.rank('sign', 3)
+    >>> [chr(key[-1]) for key in page]
+    ['+', '#', '$']
+    >>> [chr(key[-1]) for key in idx.rank('sign', 3, after=page[-1])]
+    ['=', '%', '<']
+
+Passing ``workers`` builds chunks of the range in that many processes,
+then merges their postings into the same index::
+
+    >>> merged = InvertedIndex(32, 128, workers=2)
+    >>> merged.words == idx.words
+    True
+    >>> list(merged.entries['SIGN'])
+    [35, 36, 37, 43, 60, 61, 62]
+
+Building the full index takes seconds, so servers use ``InvertedIndex.open()``,
+which builds the index once, saves it to ``INDEX_PATH``, and memory-maps
+that file on later starts. Processes mapping the same file share its pages::
+
+    >>> import tempfile, pathlib
+    >>> path = pathlib.Path(tempfile.mkdtemp()) / 'ascii.idx'
+    >>> InvertedIndex(32, 128).save(path)
+    >>> mapped = InvertedIndex.load(path, 32, 128)
+    >>> list(mapped.entries['SIGN'])
+    [35, 36, 37, 43, 60, 61, 62]
+    >>> mapped.search('capital a')
+    {'A'}
+    >>> 'BRILLIG' in mapped.entries
+    False
+
+The index never changes while a server runs, so servers keep responses
+in a ``ResultCache``, keyed by ``query_key()``: queries with the same
+words in any order and case share a key. The least recently used
+responses are evicted when their total size exceeds ``max_size`` bytes::
+
+    >>> query_key('Cat face') == query_key('FACE cat')
+    True
+    >>> cache = ResultCache(max_size=10)
+    >>> cache.put('a', b'12345')
+    >>> cache.put('b', b'12345')
+    >>> cache.get('a')
+    b'12345'
+    >>> cache.put('c', b'12345')  # evicts 'b', the least recently used
+    >>> cache.get('b') is None
+    True
+    >>> cache.stats()
+    {'entries': 2, 'size': 10, 'hits': 1, 'misses': 1, 'evictions': 1}
+
+Servers record how long each phase of a query takes, in nanoseconds,
+in a ``LatencyHistogram``. It keeps counts in buckets about 3% wide
+instead of every latency, so statistics are rounded up to their bucket::
+
+    >>> latency = LatencyHistogram()
+    >>> for millis in range(1, 101):
+    ...     latency.record(millis * 1_000_000)
+    >>> latency.count
+    100
+    >>> latency.percentile(50)
+    50331647
+    >>> stats = latency.stats()
+    >>> round(stats['p90'], 1), round(stats['max'], 1)
+    (90.2, 100.7)
 
 """
 
+import heapq
+import mmap
+import os
+import string
+import struct
 import sys
+import threading
 import unicodedata
-from collections import defaultdict
-from collections.abc import Iterator
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, defaultdict
+from collections.abc import Hashable, Iterable, Iterator, Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, repeat
+from pathlib import Path
+from typing import Any
 
 STOP_CODE: int = sys.maxunicode + 1
 
+INDEX_PATH = Path(__file__).parent.absolute() / 'charindex.idx'
+
+# Index file layout, all integers unsigned 32-bit in native byte order:
+#   header: magic, unidata_version, start, stop, word count, file size
+#   postings offsets: word count + 1 integers, into the postings
+#   postings: code points of the characters for each word, ascending
+#   words: ASCII, sorted, separated by newlines
+HEADER = struct.Struct('=4s16sIIII')
+MAGIC = b'MOJ2'
+
+# intersect_pair() gallops through a postings list at least this many times
+# longer than the codes found so far, and scans shorter lists
+GALLOP_RATIO = 8
+
+# shorter prefixes match whole words only: one letter starts too many words
+MIN_PREFIX = 2
+
+# find_codes() checks the names of the codes found so far, instead of
+# scanning postings lists at least this many times longer
+VERIFY_RATIO = 16
+
+# parallel builds split the code range into this many chunks per worker
+BUILD_CHUNKS_PER_WORKER = 8
+
+# LatencyHistogram buckets per power of two nanoseconds, as a bit count:
+# 32 buckets, so latencies are counted within about 3%
+LATENCY_SUB_BITS = 5
+
+# rank() keeps the ranked keys of recent queries, packed as integers by
+# pack_rank_key(), up to this many bytes, to cut later pages from them
+RANK_CACHE_SIZE = 16 * 2**20
+RANK_CODE_BITS = 21  # enough for sys.maxunicode
+RANK_LENGTH_BITS = 10  # enough for the longest name, under 100 characters
+RANK_MAX_HITS = 2**8 - 1  # more query words than any name has
+
+# characters in words of Unicode names, used to make typos in edits()
+WORD_CHARS = string.ascii_uppercase + string.digits
+
 Char = str
-Index = defaultdict[str, set[Char]]
+Postings = Sequence[int]  # ascending character codes
+Index = dict[str, array]
+RankKey = tuple[int, int, int]  # see rank_key()
 
 
 def tokenize(text: str) -> Iterator[str]:
@@ -46,24 +189,463 @@ def tokenize(text: str) -> Iterator[str]:
         yield word
 
 
+def gallop(postings: Postings, code: int, lo: int) -> int:
+    """Return the position of code in postings, or where it would be,
+    searching from lo with steps of 1, 2, 4... then bisecting"""
+    size = len(postings)
+    hi = lo
+    step = 1
+    while hi < size and postings[hi] < code:
+        lo = hi + 1
+        hi += step
+        step *= 2
+    return bisect_left(postings, code, lo, min(hi, size))
+
+
+def intersect_pair(found: list[int], postings: Postings) -> list[int]:
+    """Return the codes in found which are also in postings"""
+    if len(postings) < GALLOP_RATIO * len(found):
+        # similar sizes: a set intersection scans postings in C,
+        # faster than probing for each code in Python
+        return sorted(set(found).intersection(postings))
+    matches = []
+    lo = 0
+    for code in found:
+        lo = gallop(postings, code, lo)
+        if lo == len(postings):
+            break
+        if postings[lo] == code:
+            matches.append(code)
+            lo += 1
+    return matches
+
+
+def union(postings_lists: list[Postings]) -> list[int]:
+    """Return the codes found in any of the postings lists, ascending"""
+    if len(postings_lists) == 1:
+        return list(postings_lists[0])
+    return sorted(set().union(*postings_lists))
+
+
+def rank_key(code: int, words: set[str]) -> RankKey:
+    """Sort key of a result: names with more of the words matched by the
+    query come first, then shorter names, then lower codes"""
+    name = unicodedata.name(chr(code))
+    hits = sum(map(words.__contains__, name.replace('-', ' ').split()))
+    return (-hits, len(name), code)
+
+
+def pack_rank_key(key: RankKey) -> int:
+    """Return an integer that sorts like key"""
+    hits, length, code = key
+    return ((RANK_MAX_HITS + hits) << (RANK_LENGTH_BITS + RANK_CODE_BITS)
+            | length << RANK_CODE_BITS | code)
+
+
+def unpack_rank_key(packed: int) -> RankKey:
+    code = packed & ((1 << RANK_CODE_BITS) - 1)
+    length = packed >> RANK_CODE_BITS & ((1 << RANK_LENGTH_BITS) - 1)
+    hits = (packed >> (RANK_LENGTH_BITS + RANK_CODE_BITS)) - RANK_MAX_HITS
+    return (hits, length, code)
+
+
+def edits(word: str) -> set[str]:
+    """Return all strings one typo away from word"""
+    splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+    deletes = [a + b[1:] for a, b in splits if b]
+    swaps = [a + b[1] + b[0] + b[2:] for a, b in splits if len(b) > 1]
+    replaces = [a + c + b[1:] for a, b in splits if b for c in WORD_CHARS]
+    inserts = [a + c + b for a, b in splits for c in WORD_CHARS]
+    return set(deletes + swaps + replaces + inserts) - {word, ''}
+
+
+class MappedEntries(Mapping[str, Postings]):
+    """Read-only view of an index file, or of arrays laid out the same way,
+    with the same lookups as ``Index``. Postings are slices of the buffers,
+    so reading them copies nothing."""
+
+    def __init__(self, words: list[str], offsets: memoryview, postings: memoryview):
+        self.words = words  # sorted, so lookups bisect instead of hashing
+        self.offsets = offsets
+        self.postings = postings
+
+    def find(self, word: str) -> int:
+        """Return position of word in the word table, or -1"""
+        i = bisect_left(self.words, word)
+        if i < len(self.words) and self.words[i] == word:
+            return i
+        return -1
+
+    def __getitem__(self, word: str) -> Postings:
+        i = self.find(word)
+        if i < 0:
+            raise KeyError(word)
+        return self.postings[self.offsets[i]:self.offsets[i + 1]]
+
+    def __contains__(self, word: object) -> bool:
+        return isinstance(word, str) and self.find(word) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.words)
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+
+def build_entries(start: int, stop: int) -> Index:
+    """Return postings of the characters from start to stop"""
+    entries: defaultdict[str, array] = defaultdict(lambda: array('I'))
+    for code in range(start, stop):
+        name = unicodedata.name(chr(code), '')
+        if name:
+            for word in set(tokenize(name)):
+                entries[word].append(code)  # ascending, as codes are
+    return dict(entries)
+
+
+def flatten(entries: Index) -> tuple[list[str], array, array]:
+    """Return sorted words, with offsets into the concatenation of their
+    postings, as laid out in index files"""
+    words = sorted(entries)
+    offsets = array('I', [0])
+    postings = array('I')
+    for word in words:
+        postings.extend(entries[word])
+        offsets.append(len(postings))
+    return words, offsets, postings
+
+
+def build_flat(start: int, stop: int) -> tuple[list[str], array, array]:
+    """Return postings of the characters from start to stop, flattened:
+    sending a few arrays between processes is much faster than sending
+    an array per word"""
+    return flatten(build_entries(start, stop))
+
+
+def split_range(start: int, stop: int, count: int) -> list[tuple[int, int]]:
+    """Split range from start to stop into at most count adjacent ranges"""
+    size = max(1, -(-(stop - start) // count))  # ceiling division
+    return [(lo, min(lo + size, stop)) for lo in range(start, stop, size)]
+
+
+def merge_flat(parts: list[tuple[list[str], array, array]]) -> tuple[list[str], array, array]:
+    """Merge flattened postings built for adjacent ranges, given in
+    ascending order, with a k-way merge of their sorted words. Postings
+    of a word in later parts have higher codes, so they are appended."""
+    words: list[str] = []
+    offsets = array('I', [0])
+    postings = array('I')
+    cursors = [0] * len(parts)  # next word to read in each part
+    tagged = [zip(part_words, repeat(i)) for i, (part_words, _, _) in enumerate(parts)]
+    # sorted() finds the parts are sorted runs and merges them, faster
+    # than heapq.merge; a word in several parts comes first from the lowest
+    for word, i in sorted(chain.from_iterable(tagged)):
+        _, part_offsets, part_postings = parts[i]
+        j = cursors[i]
+        cursors[i] += 1
+        postings.extend(part_postings[part_offsets[j]:part_offsets[j + 1]])
+        if words and words[-1] == word:
+            offsets[-1] = len(postings)
+        else:
+            words.append(word)
+            offsets.append(len(postings))
+    return words, offsets, postings
+
+
 class InvertedIndex:
-    entries: Index
-
-    def __init__(self, start: int = 32, stop: int = STOP_CODE):
-        entries: Index = defaultdict(set)
-        for char in (chr(i) for i in range(start, stop)):
-            name = unicodedata.name(char, '')
-            if name:
-                for word in tokenize(name):
-                    entries[word].add(char)
-        self.entries = entries
-
-    def search(self, query: str) -> set[Char]:
-        if words := list(tokenize(query)):
-            found = self.entries[words[0]]
-            return found.intersection(*(self.entries[w] for w in words[1:]))
+    entries: Index | MappedEntries
+    words: list[str]  # sorted, for prefix search
+
+    def __init__(self, start: int = 32, stop: int = STOP_CODE, workers: int = 1):
+        if workers > 1:
+            # more chunks than workers: names are dense in some ranges only
+            ranges = split_range(start, stop, workers * BUILD_CHUNKS_PER_WORKER)
+            with ProcessPoolExecutor(workers) as executor:
+                parts = list(executor.map(build_flat, *zip(*ranges)))
+            words, offsets, postings = merge_flat(parts)
+            self.entries = MappedEntries(words, memoryview(offsets), memoryview(postings))
+            self.words = words
+        else:
+            entries = build_entries(start, stop)
+            self.entries = entries
+            self.words = sorted(entries)
+        self.start = start
+        self.stop = stop
+        self.ranked = ResultCache(RANK_CACHE_SIZE)
+
+    def save(self, path: Path) -> None:
+        """Write the index file, replacing any older file atomically"""
+        if isinstance(self.entries, MappedEntries):
+            words = self.words
+            offsets = self.entries.offsets
+            postings = self.entries.postings
+        else:
+            words, offsets, postings = flatten(self.entries)
+        text = '\n'.join(words).encode('ascii')
+        size = (HEADER.size + memoryview(offsets).nbytes
+                + memoryview(postings).nbytes + len(text))
+        header = HEADER.pack(MAGIC, unicodedata.unidata_version.encode(),
+                             self.start, self.stop, len(words), size)
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as fp:
+            fp.write(header)
+            fp.write(offsets)
+            fp.write(postings)
+            fp.write(text)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path, start: int = 32, stop: int = STOP_CODE) -> 'InvertedIndex':
+        """Memory-map an index file; raise ValueError if it is truncated or
+        otherwise damaged, or does not match this Python's Unicode database, or the range from
+        start to stop"""
+        with open(path, 'rb') as fp:
+            buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(buffer)
+        if len(view) < HEADER.size:
+            raise ValueError(f'{path} is truncated')
+        magic, version, file_start, file_stop, count, size = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not an index file')
+        if size != len(view):
+            raise ValueError(f'{path} is truncated')
+        if version.rstrip(b'\0').decode() != unicodedata.unidata_version:
+            raise ValueError(f'{path} is for another Unicode version')
+        if (file_start, file_stop) != (start, stop):
+            raise ValueError(f'{path} indexes another range')
+        offsets_end = HEADER.size + (count + 1) * 4
+        if offsets_end > len(view):
+            raise ValueError(f'{path} is damaged')
+        offsets = view[HEADER.size:offsets_end].cast('I')
+        postings_end = offsets_end + offsets[count] * 4
+        if postings_end > len(view):
+            raise ValueError(f'{path} is damaged')
+        postings = view[offsets_end:postings_end].cast('I')
+        words = str(view[postings_end:], 'ascii').split('\n') if count else []
+        if len(words) != count:
+            raise ValueError(f'{path} is damaged')
+        index = cls.__new__(cls)
+        index.entries = MappedEntries(words, offsets, postings)
+        index.words = words
+        index.start = start
+        index.stop = stop
+        index.ranked = ResultCache(RANK_CACHE_SIZE)
+        return index
+
+    @classmethod
+    def open(cls, path: Path = INDEX_PATH, workers: int | None = None) -> 'InvertedIndex':
+        """Load the index file, first building it if missing or stale,
+        with workers processes, by default one per CPU"""
+        try:
+            return cls.load(path)
+        except (OSError, ValueError):
+            pass
+        index = cls(workers=workers or os.cpu_count() or 1)
+        try:
+            index.save(path)
+        except OSError:
+            return index  # read-only install: keep the index in memory
+        return cls.load(path)
+
+    def words_with_prefix(self, prefix: str) -> list[str]:
+        lo = bisect_left(self.words, prefix)
+        hi = bisect_left(self.words, prefix + '\x7f', lo)  # words are ASCII
+        return self.words[lo:hi]
+
+    def similar_words(self, word: str) -> list[str]:
+        """Return words in the index one typo away from word"""
+        return sorted(w for w in edits(word) if w in self.entries)
+
+    def expand(self, word: str, prefix: bool = False, fuzzy: bool = False) -> list[str]:
+        """Return the words in the index that word of a query stands for"""
+        if prefix and len(word) >= MIN_PREFIX:
+            matches = self.words_with_prefix(word)
         else:
-            return set()
+            matches = [word] if word in self.entries else []
+        if fuzzy and not matches:
+            matches = self.similar_words(word)
+        return matches
+
+    def match_words(self, query: str, prefix: bool = False, fuzzy: bool = False) -> list[list[str]]:
+        """Return the words in the index each word of query stands for,
+        or an empty list if some word of query stands for none"""
+        words = list(dict.fromkeys(tokenize(query)))
+        matched = []
+        for i, word in enumerate(words):
+            matches = self.expand(word, prefix and i == len(words) - 1, fuzzy)
+            if not matches:
+                return []
+            matched.append(matches)
+        return matched
+
+    def find_matching(self, matched: list[list[str]]) -> list[int]:
+        """Return codes of characters with a word of each list in their names"""
+        if not matched:
+            return []
+        terms = []  # (size, words in the index, their postings lists)
+        for matches in matched:
+            postings_lists = [self.entries[match] for match in matches]
+            terms.append((sum(map(len, postings_lists)), matches, postings_lists))
+        terms.sort(key=lambda term: term[0])
+        found = union(terms[0][2])
+        for size, matches, postings_lists in terms[1:]:
+            if not found:
+                break
+            if len(postings_lists) == 1:
+                found = intersect_pair(found, postings_lists[0])
+            elif size < VERIFY_RATIO * len(found):
+                found = sorted(set(found).intersection(chain.from_iterable(postings_lists)))
+            else:
+                # few codes left: reading their names beats scanning postings
+                wanted = set(matches)
+                found = [code for code in found
+                         if not wanted.isdisjoint(tokenize(unicodedata.name(chr(code))))]
+        return found
+
+    def find_codes(self, query: str, prefix: bool = False, fuzzy: bool = False) -> list[int]:
+        """Return codes of characters with all words of query in their names.
+
+        With prefix, the last word of query may be the start of a word;
+        with fuzzy, words not in the index may have a typo."""
+        return self.find_matching(self.match_words(query, prefix, fuzzy))
+
+    def rank(self, query: str, limit: int, after: RankKey | None = None,
+             prefix: bool = False, fuzzy: bool = False) -> list[RankKey]:
+        """Return keys of the best limit results ranked after the given key.
+
+        A first page only selects the best limit results. The first call
+        for a later page ranks all results; further pages of the same
+        query are cut from the ranked keys it keeps."""
+        key = query_key(query, prefix, fuzzy)
+        if (ranked := self.ranked.get(key)) is None:
+            matched = self.match_words(query, prefix, fuzzy)
+            words = set(chain.from_iterable(matched))
+            packed = (pack_rank_key(rank_key(code, words))
+                      for code in self.find_matching(matched))
+            if after is None:
+                return [unpack_rank_key(k) for k in heapq.nsmallest(limit, packed)]
+            ranked = array('Q', sorted(packed))
+            self.ranked.put(key, ranked, len(ranked) * ranked.itemsize)
+        start = 0 if after is None else bisect_right(ranked, after, key=unpack_rank_key)
+        return [unpack_rank_key(packed) for packed in ranked[start:start + limit]]
+
+    def search(self, query: str, prefix: bool = False, fuzzy: bool = False) -> set[Char]:
+        return set(map(chr, self.find_codes(query, prefix, fuzzy)))
+
+
+def query_key(query: str, prefix: bool = False, fuzzy: bool = False) -> Hashable:
+    """Return the same key for queries InvertedIndex matches the same way"""
+    words = list(dict.fromkeys(tokenize(query)))
+    last = words.pop() if prefix and words else None  # the prefix, if any
+    return tuple(sorted(words)), last, fuzzy
+
+
+class ResultCache:
+    """Least recently used responses, up to max_size bytes in total;
+    safe to share between threads"""
+
+    def __init__(self, max_size: int = 16 * 2**20):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Any:
+        """Return response stored for key, or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: Hashable, response: Any, size: int | None = None) -> None:
+        """Store response for key; size defaults to len(response)"""
+        if size is None:
+            size = len(response)
+        if size > self.max_size:
+            return  # would evict everything else
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (response, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Invalidate all responses, as when the index is replaced"""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'entries': len(self.entries),
+            'size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class LatencyHistogram:
+    """Counts of latencies in buckets of about 3% of their value, as in
+    HdrHistogram: recording is a few integer operations, and statistics
+    are computed from the bucket counts"""
+
+    def __init__(self) -> None:
+        self.counts = [0] * (64 << LATENCY_SUB_BITS)  # enough for 2**64 ns
+
+    def record(self, nanos: int) -> None:
+        # called for every phase of every query: keep it cheap
+        shift = nanos.bit_length() - LATENCY_SUB_BITS - 1
+        if shift > 0:
+            nanos = (shift << LATENCY_SUB_BITS) + (nanos >> shift)
+        self.counts[nanos] += 1
+
+    @staticmethod
+    def bucket_limit(bucket: int) -> int:
+        """Return the highest latency counted in bucket, in nanoseconds"""
+        shift = max((bucket >> LATENCY_SUB_BITS) - 1, 0)
+        top = bucket - (shift << LATENCY_SUB_BITS)
+        return ((top + 1) << shift) - 1
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def percentile(self, percent: float) -> int:
+        """Return the latency not exceeded by percent of the records, in
+        nanoseconds, rounded up to the limit of its bucket"""
+        wanted = max(1, round(self.count * percent / 100))
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted:
+                return self.bucket_limit(bucket)
+        return 0
+
+    def stats(self) -> dict[str, float]:
+        """Return the count, and latencies in milliseconds"""
+        count = self.count
+        total = sum(count * self.bucket_limit(bucket)
+                    for bucket, count in enumerate(self.counts) if count)
+        return {
+            'count': count,
+            'mean': total / count / 1e6 if count else 0.0,
+            'p50': self.percentile(50) / 1e6,
+            'p90': self.percentile(90) / 1e6,
+            'p99': self.percentile(99) / 1e6,
+            'max': self.percentile(100) / 1e6,
+        }
 
 
 def format_results(chars: set[Char]) -> Iterator[str]:
@@ -74,11 +656,13 @@ def format_results(chars: set[Char]) -> Iterator[str]:
 
 
 def main(words: list[str]) -> None:
+    options = {option: option in words for option in ('--prefix', '--fuzzy')}
+    words = [word for word in words if word not in options]
     if not words:
         print('Please give one or more words to search.')
         sys.exit(2)  # command line usage error
-    index = InvertedIndex()
-    chars = index.search(' '.join(words))
+    index = InvertedIndex.open()
+    chars = index.search(' '.join(words), options['--prefix'], options['--fuzzy'])
     for line in format_results(chars):
         print(line)
     print('─' * 66, f'{len(chars)} found')
@@ -0,0 +1,182 @@
+"""
+InvertedIndex performance test:
+
+- startup time building the full index in memory, in one process and in
+  one process per CPU, versus memory-mapping the index file saved by the
+  first build;
+- memory used by postings lists, versus the original sets of characters;
+- query latency, mixing rare and common words;
+- search-as-you-type latency: a query per keystroke while typing names,
+  with prefix and fuzzy matching;
+- latency of selecting a page of the best 100 results, of the second
+  page, ranking all results, of the third, cut from the ranking kept by
+  the index, and of getting the first page again from a ``ResultCache``.
+"""
+
+import os
+import random
+import re
+import statistics
+import tempfile
+import time
+import tracemalloc
+import unicodedata
+from collections import defaultdict
+from pathlib import Path
+
+from charindex import STOP_CODE, InvertedIndex, ResultCache, query_key, tokenize
+
+QUERIES = [
+    'cat face',
+    'sign',
+    'letter',
+    'latin small letter',
+    'small letter with',
+    'arabic letter with dot below',
+    'cjk compatibility ideograph',
+    'brillig',
+]
+
+
+class SetIndex:
+    """The original index: a set of characters per word"""
+
+    def __init__(self, start: int = 32, stop: int = STOP_CODE):
+        self.entries: defaultdict[str, set[str]] = defaultdict(set)
+        for char in (chr(i) for i in range(start, stop)):
+            name = unicodedata.name(char, '')
+            if name:
+                for word in tokenize(name):
+                    self.entries[word].add(char)
+
+    def search(self, query: str) -> set[str]:
+        if words := list(tokenize(query)):
+            found = self.entries[words[0]]
+            return found.intersection(*(self.entries[w] for w in words[1:]))
+        else:
+            return set()
+
+
+def test_startup(path: Path) -> None:
+    t0 = time.perf_counter()
+    index = InvertedIndex()
+    built = time.perf_counter() - t0
+    workers = os.cpu_count() or 1
+    t0 = time.perf_counter()
+    InvertedIndex(workers=workers)
+    built_parallel = time.perf_counter() - t0
+    index.save(path)
+    t0 = time.perf_counter()
+    InvertedIndex.load(path)
+    loaded = time.perf_counter() - t0
+    print(f'|   build|{built * 1e3:10.1f} ms|')
+    print(f'|parallel|{built_parallel * 1e3:10.1f} ms|{workers:3d} processes')
+    print(f'|    load|{loaded * 1e3:10.1f} ms|{path.stat().st_size / 2**20:6.1f} MiB file')
+
+
+def traced_build(factory):
+    tracemalloc.start()
+    index = factory()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return index, size
+
+
+def test_queries(label: str, index, size: int, repeat: int = 20) -> None:
+    latencies = []
+    for query in QUERIES * repeat:
+        t0 = time.perf_counter()
+        index.search(query)
+        latencies.append(time.perf_counter() - t0)
+    latencies.sort()
+    p50 = statistics.median(latencies)
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print(f'|{label:>8}|{size / 2**20:8.1f} MiB|{p50 * 1e3:8.2f} ms p50|{p99 * 1e3:8.2f} ms p99')
+
+
+def typed_queries(n_names: int = 200) -> list[str]:
+    """Return the queries sent while typing names of random characters,
+    skipping names that end with the code point in hex"""
+    generated = re.compile(r'-[0-9A-F]{4,5}$')
+    rnd = random.Random(1)
+    names: list[str] = []
+    while len(names) < n_names:
+        name = unicodedata.name(chr(rnd.randrange(32, STOP_CODE)), '')
+        if name and not generated.search(name):
+            names.append(name)
+    return [name[:i] for name in names for i in range(1, len(name) + 1)]
+
+
+def test_typing(index: InvertedIndex) -> None:
+    latencies = []
+    for query in typed_queries():
+        t0 = time.perf_counter()
+        index.search(query, prefix=True, fuzzy=True)
+        latencies.append(time.perf_counter() - t0)
+    latencies.sort()
+    p50 = statistics.median(latencies)
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print(f'|  typing|{len(latencies):6d} queries|{p50 * 1e3:8.2f} ms p50|{p99 * 1e3:8.2f} ms p99')
+
+
+def test_ranking(index: InvertedIndex, repeat: int = 5) -> None:
+    latencies = []
+    for query in QUERIES * repeat:
+        index.ranked.clear()
+        t0 = time.perf_counter()
+        index.rank(query, 100)
+        latencies.append(time.perf_counter() - t0)
+    latencies.sort()
+    p50 = statistics.median(latencies)
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print(f'| ranking|   top 100|{p50 * 1e3:8.2f} ms p50|{p99 * 1e3:8.2f} ms p99')
+
+    for label in 'page 2', 'page 3':
+        latencies = []
+        for query in QUERIES * repeat:
+            if label == 'page 2':
+                index.ranked.clear()
+            page = index.rank(query, 100)
+            if label == 'page 3' and page:
+                page = index.rank(query, 100, after=page[-1])
+            after = page[-1] if page else None
+            t0 = time.perf_counter()
+            index.rank(query, 100, after=after)
+            latencies.append(time.perf_counter() - t0)
+        latencies.sort()
+        p50 = statistics.median(latencies)
+        p99 = latencies[int(len(latencies) * 0.99)]
+        print(f'| ranking|{label:>10}|{p50 * 1e3:8.3f} ms p50|{p99 * 1e3:8.3f} ms p99')
+
+    cache = ResultCache()
+    for query in QUERIES:
+        cache.put(query_key(query), index.rank(query, 100), 1)
+    latencies = []
+    for query in QUERIES * repeat:
+        t0 = time.perf_counter()
+        cache.get(query_key(query))
+        latencies.append(time.perf_counter() - t0)
+    latencies.sort()
+    p50 = statistics.median(latencies)
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print(f'|  cached|   top 100|{p50 * 1e3:8.3f} ms p50|{p99 * 1e3:8.3f} ms p99')
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'charindex.idx'
+        test_startup(path)
+        print('|   index|      memory|     latency|     latency')
+        sets, size = traced_build(SetIndex)
+        test_queries('sets', sets, size)
+        del sets
+        arrays, size = traced_build(InvertedIndex)
+        test_queries('arrays', arrays, size)
+        mapped, size = traced_build(lambda: InvertedIndex.load(path))
+        test_queries('mmap', mapped, size)
+        test_typing(mapped)
+        test_ranking(mapped)
+
+
+if __name__ == '__main__':
+    main()
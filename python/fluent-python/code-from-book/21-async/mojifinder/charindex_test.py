@@ -0,0 +1,39 @@
+import pytest
+
+from charindex import HEADER, InvertedIndex
+
+
+@pytest.fixture(scope='module')
+def saved(tmp_path_factory):
+    path = tmp_path_factory.mktemp('index') / 'charindex.idx'
+    InvertedIndex(workers=1).save(path)
+    return path.read_bytes()
+
+
+@pytest.mark.parametrize('size', [
+    0,
+    7,                 # inside the header
+    HEADER.size + 10,  # inside the offsets
+    0.5,               # inside the postings
+    0.99,              # inside the words
+])
+def test_open_rebuilds_truncated_index(saved, tmp_path, size):
+    if isinstance(size, float):
+        size = int(len(saved) * size)
+    path = tmp_path / 'charindex.idx'
+    path.write_bytes(saved[:size])
+    assert_rebuilt(saved, path)
+
+
+def test_open_rebuilds_index_with_trailing_bytes(saved, tmp_path):
+    path = tmp_path / 'charindex.idx'
+    path.write_bytes(saved + b'\nzebra')
+    assert_rebuilt(saved, path)
+
+
+def assert_rebuilt(saved, path):
+    with pytest.raises(ValueError):
+        InvertedIndex.load(path)
+    index = InvertedIndex.open(path, workers=1)
+    assert path.read_bytes() == saved
+    assert index.search('cat face') == {'😸', '😹', '😺', '😻', '😼', '😽', '😾', '😿', '🙀', '🐱'}
@@ -3,34 +3,59 @@
 # tag::TCP_MOJIFINDER_TOP[]
 import asyncio
 import functools
+import itertools
+import multiprocessing
+import os
+import signal
 import sys
+import time
 from asyncio.trsock import TransportSocket
+from collections.abc import Hashable
 from typing import cast
 
-from charindex import InvertedIndex, format_results  # <1>
+from charindex import (InvertedIndex, LatencyHistogram, ResultCache,  # <1>
+                       format_results, query_key)
 
 CRLF = b'\r\n'
 PROMPT = b'?> '
+OFFLOAD_RESULTS = 500  # format more results than this in a thread
+MAX_RESULTS = 1000  # results sent per query, on every connection
+WRITE_CHUNK = 16 * 1024  # bytes written at a time
+WRITE_BUFFER_LIMIT = 64 * 1024  # bytes buffered per connection before waiting
+SLOW_QUERY = 100_000_000  # nanoseconds; slower queries are logged
+STATS_COMMAND = '/stats'
+PHASES = ('parse', 'search', 'format', 'write')  # timed in latency histograms
+
+latency = {phase: LatencyHistogram() for phase in PHASES}
+# clients asking a query that is being answered await the same task
+in_flight: dict[Hashable, asyncio.Task[tuple[int, bytes]]] = {}
 
 async def finder(index: InvertedIndex,          # <2>
+                 cache: ResultCache,
                  reader: asyncio.StreamReader,
                  writer: asyncio.StreamWriter) -> None:
     client = writer.get_extra_info('peername')  # <3>
+    writer.transport.set_write_buffer_limits(high=WRITE_BUFFER_LIMIT)
     while True:  # <4>
         writer.write(PROMPT)  # can't await!  # <5>
         await writer.drain()  # must await!  # <6>
         data = await reader.readline()  # <7>
         if not data:  # <8>
             break
+        started = time.perf_counter_ns()
         try:
             query = data.decode().strip()  # <9>
         except UnicodeDecodeError:  # <10>
             query = '\x00'
+        latency['parse'].record(time.perf_counter_ns() - started)
         print(f' From {client}: {query!r}')  # <11>
         if query:
             if ord(query[:1]) < 32:  # <12>
                 break
-            results = await search(query, index, writer)  # <13>
+            if query == STATS_COMMAND:
+                await write_chunks(writer, encode_stats(cache))
+                continue
+            results = await search(query, index, cache, writer)  # <13>
             print(f'   To {client}: {results} results.')  # <14>
 
     writer.close()  # <15>
@@ -41,38 +66,143 @@ async def finder(index: InvertedIndex,          # <2>
 # tag::TCP_MOJIFINDER_SEARCH[]
 async def search(query: str,  # <1>
                  index: InvertedIndex,
+                 cache: ResultCache,
                  writer: asyncio.StreamWriter) -> int:
+    key = query_key(query)
+    if (response := cache.get(key)) is None:
+        started = time.perf_counter_ns()
+        # clients asking the same query meanwhile share one response
+        if (task := in_flight.get(key)) is None:
+            task = asyncio.create_task(build_response(query, index))
+            in_flight[key] = task
+            task.add_done_callback(functools.partial(finish_response, cache, key))
+        response = await asyncio.shield(task)  # runs on if this client leaves
+        ready = time.perf_counter_ns()
+    else:
+        # most queries: skip a clock reading, as a cached response is ready
+        started = ready = time.perf_counter_ns()
+    count, payload = response
+    await write_chunks(writer, payload)
+    done = time.perf_counter_ns()
+    latency['write'].record(done - ready)
+    if done - started > SLOW_QUERY:
+        # a slow response is a slow query; a slow write, a slow client
+        client = writer.get_extra_info('peername')
+        print(f' Slow {client}: {query!r} took {(done - started) / 1e6:.1f} ms: '
+              f'response {(ready - started) / 1e6:.1f} ms, '
+              f'write {(done - ready) / 1e6:.1f} ms')
+    return count
+
+async def build_response(query: str, index: InvertedIndex) -> tuple[int, bytes]:
+    started = time.perf_counter_ns()
     chars = index.search(query)  # <2>
-    lines = (line.encode() + CRLF for line  # <3>
-                in format_results(chars))
-    writer.writelines(lines)  # <4>
-    await writer.drain()      # <5>
-    status_line = f'{"─" * 66} {len(chars)} found'  # <6>
-    writer.write(status_line.encode() + CRLF)
-    await writer.drain()
-    return len(chars)
+    searched = time.perf_counter_ns()
+    latency['search'].record(searched - started)
+    if len(chars) > OFFLOAD_RESULTS:
+        # formatting would block every other client of this loop
+        loop = asyncio.get_running_loop()
+        payload = await loop.run_in_executor(None, encode_results, chars, MAX_RESULTS)
+    else:
+        payload = encode_results(chars, MAX_RESULTS)
+    latency['format'].record(time.perf_counter_ns() - searched)
+    return len(chars), payload
+
+def encode_results(chars: set[str], limit: int = MAX_RESULTS) -> bytes:
+    lines = [line.encode() + CRLF for line  # <3>
+                in itertools.islice(format_results(chars), limit)]
+    if len(chars) > limit:  # <4>
+        status_line = f'{"─" * 66} {limit} of {len(chars)} found'
+    else:
+        status_line = f'{"─" * 66} {len(chars)} found'
+    lines.append(status_line.encode() + CRLF)
+    return b''.join(lines)
+
+def finish_response(cache: ResultCache, key: Hashable,
+                    task: asyncio.Task[tuple[int, bytes]]) -> None:
+    del in_flight[key]
+    if not task.cancelled() and task.exception() is None:
+        response = task.result()
+        cache.put(key, response, len(response[1]))
+
+async def write_chunks(writer: asyncio.StreamWriter, payload: bytes) -> None:
+    """Write payload a chunk at a time, so a slow client makes this
+    coroutine wait instead of making the server buffer its whole reply"""
+    view = memoryview(payload)
+    for start in range(0, len(view), WRITE_CHUNK):
+        writer.write(view[start:start + WRITE_CHUNK])  # <5>
+        await writer.drain()    # waits while the buffer is over the limit  # <6>
+        await asyncio.sleep(0)  # let other clients run between chunks
 # end::TCP_MOJIFINDER_SEARCH[]
 
+def format_stats(cache: ResultCache) -> list[str]:
+    """Return lines with latency percentiles of each phase, in ms, and
+    result cache counters"""
+    lines = [f'{"phase":8}{"count":>8}' +
+             ''.join(f'{name:>9}' for name in ('mean', 'p50', 'p90', 'p99', 'max'))]
+    for phase in PHASES:
+        stats = latency[phase].stats()
+        lines.append(f'{phase:8}{stats.pop("count"):8d}' +
+                     ''.join(f'{value:9.3f}' for value in stats.values()))
+    lines.append(f'cache: {cache.stats()}')
+    return lines
+
+def encode_stats(cache: ResultCache) -> bytes:
+    return b''.join(line.encode() + CRLF for line in format_stats(cache))
+
 # tag::TCP_MOJIFINDER_MAIN[]
-async def supervisor(index: InvertedIndex, host: str, port: int) -> None:
-    server = await asyncio.start_server(    # <1>
-        functools.partial(finder, index),   # <2>
-        host, port)                         # <3>
+async def supervisor(index: InvertedIndex, cache: ResultCache,
+                     host: str, port: int, reuse_port: bool = False) -> None:
+    server = await asyncio.start_server(          # <1>
+        functools.partial(finder, index, cache),  # <2>
+        host, port, reuse_port=reuse_port)        # <3>
 
     socket_list = cast(tuple[TransportSocket, ...], server.sockets)  # <4>
     addr = socket_list[0].getsockname()
     print(f'Serving on {addr}. Hit CTRL-C to stop.')  # <5>
     await server.serve_forever()  # <6>
 
-def main(host: str = '127.0.0.1', port_arg: str = '2323'):
+def main(host: str = '127.0.0.1', port_arg: str = '2323', workers: int = 1):
     port = int(port_arg)
-    print('Building index.')
-    index = InvertedIndex()                         # <7>
+    print('Loading index.')
+    index = InvertedIndex.open()  # <7>
+    if workers == 1:
+        serve(index, host, port)
+        return
+    # forked workers share the pages of the mapped index file; each one
+    # listens on its own socket bound to the same port with SO_REUSEPORT,
+    # and the kernel spreads connections across them
+    fork = multiprocessing.get_context('fork')
+    procs = [fork.Process(target=serve, args=(index, host, port, True))
+             for _ in range(workers)]
+    for proc in procs:
+        proc.start()
+    try:
+        for proc in procs:
+            proc.join()
+    except KeyboardInterrupt:
+        # CTRL-C signals the workers too, but SIGINT sent to this process
+        # alone must be passed on
+        for proc in procs:
+            proc.join(timeout=1)
+            if proc.is_alive():
+                os.kill(proc.pid, signal.SIGINT)
+                proc.join()
+
+def serve(index: InvertedIndex, host: str, port: int,
+          reuse_port: bool = False) -> None:
+    cache = ResultCache()
     try:
-        asyncio.run(supervisor(index, host, port))  # <8>
-    except KeyboardInterrupt:                       # <9>
-        print('\nServer shut down.')
+        asyncio.run(supervisor(index, cache, host, port, reuse_port))  # <8>
+    except KeyboardInterrupt:                              # <9>
+        print(f'\nServer {os.getpid()} shut down.')
+        print(*format_stats(cache), sep='\n')
 
 if __name__ == '__main__':
-    main(*sys.argv[1:])
+    args = sys.argv[1:]
+    workers = 1
+    if '--workers' in args:
+        i = args.index('--workers')
+        workers = int(args[i + 1])
+        del args[i:i + 2]
+    main(*args, workers=workers)
 # end::TCP_MOJIFINDER_MAIN[]
@@ -0,0 +1,126 @@
+"""
+tcp_mojifinder load generator
+
+Starts ``tcp_mojifinder.py --workers N`` for N = 1, 2, 4... up to the
+number of CPUs, and prints queries/sec served to concurrent clients,
+each sending a mix of narrow and broad queries over its own connection.
+Then compares the time tcp_mojifinder spends timing the phases of a
+query with the CPU time one worker spends per query.
+
+Usage: python tcp_mojifinder_perftest.py [clients] [queries per client]
+"""
+
+import asyncio
+import os
+import resource
+import signal
+import subprocess
+import sys
+import time
+
+from charindex import LatencyHistogram
+from tcp_mojifinder import CRLF, PROMPT, SLOW_QUERY
+
+HOST = '127.0.0.1'
+PORT = 2324
+READ_LIMIT = 2**24  # bytes; responses to broad queries are long
+QUERIES = ['cat face', 'chess', 'sun', 'heart', 'arrow', 'face', 'sign', 'hand']
+
+
+async def client(n_queries: int) -> int:
+    reader, writer = await asyncio.open_connection(HOST, PORT, limit=READ_LIMIT)
+    await reader.readuntil(PROMPT)
+    for i in range(n_queries):
+        writer.write(QUERIES[i % len(QUERIES)].encode() + CRLF)
+        await reader.readuntil(b' found' + CRLF + PROMPT)
+    writer.close()
+    await writer.wait_closed()
+    return n_queries
+
+
+async def load(n_clients: int, n_queries: int) -> float:
+    t0 = time.perf_counter()
+    served = await asyncio.gather(*(client(n_queries) for _ in range(n_clients)))
+    return sum(served) / (time.perf_counter() - t0)
+
+
+def wait_for_server(server: subprocess.Popen) -> None:
+    async def connect() -> None:
+        reader, writer = await asyncio.open_connection(HOST, PORT)
+        await reader.readuntil(PROMPT)
+        writer.close()
+        await writer.wait_closed()
+
+    while server.poll() is None:
+        try:
+            asyncio.run(connect())
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('server exited')
+
+
+def test(workers: int, n_clients: int, n_queries: int) -> tuple[float, float]:
+    """Return queries/sec, and CPU seconds used by the server processes"""
+    cpu_before = children_cpu()
+    server = subprocess.Popen(
+        [sys.executable, 'tcp_mojifinder.py', HOST, str(PORT), '--workers', str(workers)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    try:
+        wait_for_server(server)
+        time.sleep(0.5)  # let every worker start listening
+        rate = asyncio.run(load(n_clients, n_queries))
+    finally:
+        os.killpg(server.pid, signal.SIGINT)  # like CTRL-C: all workers
+        server.wait()
+    return rate, children_cpu() - cpu_before
+
+
+def children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def instrumentation_cost(n: int = 100_000, repeat: int = 5) -> float:
+    """Return seconds spent reading the clock and recording latencies for
+    a query found in the result cache, as tcp_mojifinder does: four clock
+    readings, and the parse and write phases recorded. Like timeit, the
+    best of repeat runs is the least disturbed by other processes."""
+    latency = {'parse': LatencyHistogram(), 'write': LatencyHistogram()}
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(n):
+            started = time.perf_counter_ns()
+            latency['parse'].record(time.perf_counter_ns() - started)
+            started = ready = time.perf_counter_ns()
+            done = time.perf_counter_ns()
+            latency['write'].record(done - ready)
+            if done - started > SLOW_QUERY:
+                print('slow')
+        best = min(best, (time.perf_counter() - t0) / n)
+    return best
+
+
+def main() -> None:
+    n_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    n_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    cpus = os.cpu_count() or 1
+    print(f'{n_clients} clients, {n_queries} queries each, {cpus} CPUs')
+    print('| workers|  queries/s')
+    workers = 1
+    while workers <= cpus:
+        rate, cpu = test(workers, n_clients, n_queries)
+        print(f'|{workers:8d}|{rate:11.0f}')
+        if workers == 1:
+            # starting and stopping the server, without queries, as baseline
+            _, idle_cpu = test(1, n_clients, 0)
+            per_query = (cpu - idle_cpu) / (n_clients * n_queries)
+        workers *= 2
+    cost = instrumentation_cost()
+    print(f'instrumentation: {cost * 1e6:.1f} µs per query, '
+          f'{cost / per_query:.2%} of {per_query * 1e6:.0f} µs server CPU per query')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+tcp_mojifinder slow client simulator
+
+Connects clients that send a broad query, then read the reply a few
+hundred bytes at a time, while one fast client keeps sending a narrow
+query. Prints the server's resident memory and the fast client's p99
+latency, for a server without write limits or result caps, as
+tcp_mojifinder was before streaming, and for the default settings.
+Linux only: memory is read from /proc.
+
+Usage: python tcp_mojifinder_slow_perftest.py [slow clients] [seconds]
+"""
+
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from tcp_mojifinder import CRLF, PROMPT
+
+HOST = '127.0.0.1'
+PORT = 2325
+READ_LIMIT = 2**24
+BROAD_QUERY = b'cjk'  # about 4 MiB of results
+NARROW_QUERY = b'cat face'
+
+UNLIMITED = (
+    'import tcp_mojifinder as t; '
+    't.MAX_RESULTS = t.WRITE_CHUNK = t.WRITE_BUFFER_LIMIT = 2**31 - 1; '
+)
+SETTINGS = {
+    'unlimited': UNLIMITED,
+    'streaming': 'import tcp_mojifinder as t; ',
+}
+
+
+def rss(pid: int) -> int:
+    """Return resident set size of process in bytes"""
+    with open(f'/proc/{pid}/status') as fp:
+        for line in fp:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    raise ValueError(f'no VmRSS for process {pid}')
+
+
+async def open_slow_connection() -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.setblocking(False)
+    await asyncio.get_running_loop().sock_connect(sock, (HOST, PORT))
+    return await asyncio.open_connection(sock=sock, limit=READ_LIMIT)
+
+
+async def slow_client(stop: float) -> None:
+    reader, writer = await open_slow_connection()
+    await reader.readuntil(PROMPT)
+    writer.write(BROAD_QUERY + CRLF)
+    while time.monotonic() < stop:
+        if not await reader.read(256):
+            break
+        await asyncio.sleep(0.05)
+    writer.close()
+
+
+async def fast_client(stop: float) -> list[float]:
+    reader, writer = await asyncio.open_connection(HOST, PORT, limit=READ_LIMIT)
+    await reader.readuntil(PROMPT)
+    latencies = []
+    while time.monotonic() < stop:
+        t0 = time.perf_counter()
+        writer.write(NARROW_QUERY + CRLF)
+        await reader.readuntil(b' found' + CRLF + PROMPT)
+        latencies.append(time.perf_counter() - t0)
+        await asyncio.sleep(0.01)
+    writer.close()
+    return latencies
+
+
+async def load(pid: int, n_slow: int, seconds: float) -> tuple[int, float]:
+    stop = time.monotonic() + seconds
+    slow = [asyncio.create_task(slow_client(stop)) for _ in range(n_slow)]
+    fast = asyncio.create_task(fast_client(stop))
+    peak = 0
+    while time.monotonic() < stop:
+        peak = max(peak, rss(pid))
+        await asyncio.sleep(0.1)
+    latencies = await fast
+    await asyncio.gather(*slow, return_exceptions=True)
+    latencies.sort()
+    return peak, latencies[int(len(latencies) * 0.99)]
+
+
+def wait_for_server(server: subprocess.Popen) -> None:
+    while server.poll() is None:
+        try:
+            with socket.create_connection((HOST, PORT)) as sock:
+                sock.recv(len(PROMPT))
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('server exited')
+
+
+def test(setting: str, n_slow: int, seconds: float) -> tuple[int, int, float]:
+    code = SETTINGS[setting] + f't.main({HOST!r}, {str(PORT)!r})'
+    server = subprocess.Popen([sys.executable, '-c', code],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              start_new_session=True)
+    try:
+        wait_for_server(server)
+        idle = rss(server.pid)
+        peak, p99 = asyncio.run(load(server.pid, n_slow, seconds))
+        return idle, peak, p99
+    finally:
+        os.killpg(server.pid, signal.SIGINT)
+        server.wait()
+
+
+def main() -> None:
+    n_slow = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    print(f'{n_slow} slow clients, {seconds:.0f}s')
+    print('|   setting| idle MiB| peak MiB| fast client p99 ms')
+    for setting in SETTINGS:
+        idle, peak, p99 = test(setting, n_slow, seconds)
+        print(f'|{setting:>10}|{idle / 2**20:9.1f}|{peak / 2**20:9.1f}|{p99 * 1e3:19.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+from tcp_mojifinder import CRLF, encode_results
+
+LETTERS = {chr(code) for code in range(ord('A'), ord('Z') + 1)}
+
+
+def test_encode_results_over_limit():
+    lines = encode_results(LETTERS, 10).split(CRLF)
+    assert lines.pop() == b''
+    assert len(lines) == 11
+    assert lines[0].decode().endswith('LATIN CAPITAL LETTER A')
+    assert lines[-1].decode() == f'{"─" * 66} 10 of 26 found'
+
+
+def test_encode_results_within_limit():
+    lines = encode_results(LETTERS, 26).split(CRLF)
+    assert lines.pop() == b''
+    assert len(lines) == 27
+    assert lines[-1].decode() == f'{"─" * 66} 26 found'
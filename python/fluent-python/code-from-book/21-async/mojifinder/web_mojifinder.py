@@ -1,13 +1,16 @@
+import json
 from pathlib import Path
 from unicodedata import name
 
-from fastapi import FastAPI
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, Response
 from pydantic import BaseModel
 
-from charindex import InvertedIndex
+from charindex import InvertedIndex, RankKey, ResultCache, query_key
 
 STATIC_PATH = Path(__file__).parent.absolute() / 'static'  # <1>
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
 
 app = FastAPI(  # <2>
     title='Mojifinder Web',
@@ -19,15 +22,47 @@ class CharName(BaseModel):  # <3>
     name: str
 
 def init(app):  # <4>
-    app.state.index = InvertedIndex()
+    app.state.index = InvertedIndex.open()
+    app.state.cache = ResultCache()  # responses depend on the index
     app.state.form = (STATIC_PATH / 'form.html').read_text()
 
 init(app)  # <5>
 
+def encode_cursor(key: RankKey) -> str:
+    return '.'.join(map(str, key))
+
+def decode_cursor(cursor: str) -> RankKey:
+    try:
+        hits, length, code = map(int, cursor.split('.'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail='invalid cursor')
+    return hits, length, code
+
 @app.get('/search', response_model=list[CharName])  # <6>
-async def search(q: str):  # <7>
-    chars = sorted(app.state.index.search(q))
-    return ({'char': c, 'name': name(c)} for c in chars)  # <8>
+def search(request: Request, q: str,  # <7>
+           prefix: bool = False, fuzzy: bool = False,
+           limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+           cursor: str | None = None):
+    """Best matches first; a Link header points to the next page, if any."""
+    after = decode_cursor(cursor) if cursor else None
+    key = query_key(q, prefix, fuzzy), limit, after
+    if (page := app.state.cache.get(key)) is None:
+        keys = app.state.index.rank(q, limit, after, prefix, fuzzy)
+        chars = (chr(key[-1]) for key in keys)
+        body = json.dumps([{'char': c, 'name': name(c)} for c in chars])  # <8>
+        last = keys[-1] if len(keys) == limit else None
+        page = body.encode(), last
+        app.state.cache.put(key, page, len(page[0]))
+    body, last = page
+    headers = {}
+    if last is not None:
+        next_url = request.url.include_query_params(cursor=encode_cursor(last))
+        headers['Link'] = f'<{next_url}>; rel="next"'
+    return Response(body, media_type='application/json', headers=headers)
+
+@app.get('/stats')
+def stats():
+    return {'cache': app.state.cache.stats()}
 
 @app.get('/', response_class=HTMLResponse, include_in_schema=False)
 def form():  # <9>
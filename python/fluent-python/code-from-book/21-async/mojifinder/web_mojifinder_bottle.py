@@ -27,7 +27,7 @@ def search():
 
 def main(port):
     global index
-    index = InvertedIndex()
+    index = InvertedIndex.open()
     run(host='localhost', port=port, debug=True)
 
 
@@ -1,15 +1,25 @@
 """Majordomo Protocol definitions"""
 #  This is the version of MDP/Client we implement
-C_CLIENT = "MDPC01"
+C_CLIENT = b"MDPC01"
 
 #  This is the version of MDP/Worker we implement
-W_WORKER = "MDPW01"
+W_WORKER = b"MDPW01"
 
-#  MDP/Server commands, as strings
-W_READY = "\001"
-W_REQUEST = "\002"
-W_REPLY = "\003"
-W_HEARTBEAT = "\004"
-W_DISCONNECT = "\005"
+#  MDP/Server commands, as bytes
+W_READY = b"\001"
+W_REQUEST = b"\002"
+W_REPLY = b"\003"
+W_HEARTBEAT = b"\004"
+W_DISCONNECT = b"\005"
 
-commands = [None, "READY", "REQUEST", "REPLY", "HEARTBEAT", "DISCONNECT"]
+#  Header of a reply from the broker itself, in place of C_CLIENT: the
+#  frame after the service name is a status code, and there is no body.
+#  Replies from workers always come with C_CLIENT, so whatever a worker
+#  replies can't be mistaken for a status.
+C_STATUS = b"MDPC01S"
+
+#  Status the broker replies with when a service queue is full
+#  (same code space as 8/MMI return codes)
+S_OVERLOADED = b"503"
+
+commands = [None, b"READY", b"REQUEST", b"REPLY", b"HEARTBEAT", b"DISCONNECT"]
@@ -8,26 +8,29 @@ Based on Java example by Arkadiusz Orzechowski
 
 import logging
 import sys
+import threading
 import time
+import zlib
 from binascii import hexlify
+from collections import OrderedDict, deque
 
 # local
 import MDP
 import zmq
-from zhelpers import dump
+from zhelpers import dump, find_delimiter, frame_bytes, send_envelope
 
 
 class Service(object):
     """a single Service"""
 
     name = None  # Service name
-    requests = None  # List of client requests
-    waiting = None  # List of waiting workers
+    requests = None  # Queue of (time queued, client request)
+    waiting = None  # Waiting workers, by identity, oldest first
 
     def __init__(self, name):
         self.name = name
-        self.requests = []
-        self.waiting = []
+        self.requests = deque()
+        self.waiting = OrderedDict()
 
 
 class Worker(object):
@@ -37,11 +40,13 @@ class Worker(object):
     address = None  # Address to route to
     service = None  # Owning service, if known
     expiry = None  # expires at this point, unless heartbeat
+    slot = None  # Heartbeat timer wheel slot
 
-    def __init__(self, identity, address, lifetime):
+    def __init__(self, identity, address, lifetime, slot):
         self.identity = identity
         self.address = address
-        self.expiry = time.time() + 1e-3 * lifetime
+        self.slot = slot
+        self.expiry = time.monotonic() + 1e-3 * lifetime
 
 
 class MajorDomoBroker(object):
@@ -55,6 +60,11 @@ class MajorDomoBroker(object):
     HEARTBEAT_LIVENESS = 3  # 3-5 is reasonable
     HEARTBEAT_INTERVAL = 2500  # msecs
     HEARTBEAT_EXPIRY = HEARTBEAT_INTERVAL * HEARTBEAT_LIVENESS
+    HEARTBEAT_SLOTS = 10  # ticks per HEARTBEAT_INTERVAL
+    COPY_THRESHOLD = zmq.COPY_THRESHOLD  # bytes, larger frames go zero-copy
+    RECV_BATCH = 100  # most messages handled per poll
+    SERVICE_HWM = 1000  # most requests queued per service, None for no limit
+    REQUEST_TTL = None  # msecs a request may stay queued, None for no limit
 
     # ---------------------------------------------------------------------
 
@@ -62,25 +72,38 @@ class MajorDomoBroker(object):
     socket = None  # Socket for clients & workers
     poller = None  # our Poller
 
-    heartbeat_at = None  # When to send HEARTBEAT
+    heartbeat_at = None  # When to send HEARTBEAT, i.e. next tick
+    heartbeat_tick = None  # Seconds between ticks
+    heartbeat_wheel = None  # Idle workers per slot, heartbeated on its tick
+    heartbeat_slot = 0  # Slot of the current tick
+    next_slot = 0  # Slot for the next new worker
     services = None  # known services
     workers = None  # known workers
-    waiting = None  # idle workers
+    waiting = None  # idle workers, by identity, ordered by expiry
+    shard = False  # whether a MajorDomoShardedBroker front end is ours
 
     verbose = False  # Print activity to stdout
 
     # ---------------------------------------------------------------------
 
-    def __init__(self, verbose=False):
-        """Initialize broker state."""
+    def __init__(self, verbose=False, ctx=None, socket_type=zmq.ROUTER):
+        """Initialize broker state.
+
+        A shard of a MajorDomoShardedBroker shares the front end's context
+        and talks to it over a PAIR socket instead of a ROUTER.
+        """
         self.verbose = verbose
+        self.shard = socket_type == zmq.PAIR
         self.services = {}
         self.workers = {}
-        self.waiting = []
-        self.heartbeat_at = time.time() + 1e-3 * self.HEARTBEAT_INTERVAL
-        self.ctx = zmq.Context()
-        self.socket = self.ctx.socket(zmq.ROUTER)
+        self.waiting = OrderedDict()
+        self.heartbeat_tick = 1e-3 * self.HEARTBEAT_INTERVAL / self.HEARTBEAT_SLOTS
+        self.heartbeat_wheel = [{} for _ in range(self.HEARTBEAT_SLOTS)]
+        self.heartbeat_at = time.monotonic() + self.heartbeat_tick
+        self.ctx = ctx if ctx is not None else zmq.Context()
+        self.socket = self.ctx.socket(socket_type)
         self.socket.linger = 0
+        self.socket.copy_threshold = self.COPY_THRESHOLD
         self.poller = zmq.Poller()
         self.poller.register(self.socket, zmq.POLLIN)
         logging.basicConfig(
@@ -94,62 +117,94 @@ class MajorDomoBroker(object):
     def mediate(self):
         """Main broker work happens here"""
         while True:
+            timeout = max(0, 1e3 * (self.heartbeat_at - time.monotonic()))
             try:
-                items = self.poller.poll(self.HEARTBEAT_INTERVAL)
+                items = self.poller.poll(timeout)
             except KeyboardInterrupt:
                 break  # Interrupted
-            if items:
-                msg = self.socket.recv_multipart()
+            # Pipelining clients keep many requests queued, so drain up to
+            # RECV_BATCH messages per poll instead of polling for each one.
+            for _ in range(self.RECV_BATCH if items else 0):
+                try:
+                    # Frames are not copied out of the socket; the message
+                    # is passed around whole, envelopes are read by index.
+                    msg = self.socket.recv_multipart(zmq.NOBLOCK, copy=False)
+                except zmq.Again:
+                    break
                 if self.verbose:
                     logging.info("I: received message:")
                     dump(msg)
 
-                sender = msg.pop(0)
-                empty = msg.pop(0)
-                assert empty == b""
-                header = msg.pop(0)
+                # Clients may stack a correlation tag between their
+                # address and the empty delimiter frame.
+                delimiter = find_delimiter(msg)
+                assert len(msg) >= delimiter + 2
+                sender = frame_bytes(msg[0])
+                header = frame_bytes(msg[delimiter + 1])
 
                 if MDP.C_CLIENT == header:
-                    self.process_client(sender, msg)
-                elif MDP.W_WORKER == header:
+                    self.process_client(sender, msg, delimiter)
+                elif MDP.W_WORKER == header and delimiter == 1:
                     self.process_worker(sender, msg)
                 else:
                     logging.error("E: invalid message:")
                     dump(msg)
 
-            self.purge_workers()
-            self.send_heartbeats()
+            now = time.monotonic()
+            self.purge_workers(now)
+            self.purge_requests(now)
+            self.send_heartbeats(now)
 
     def destroy(self):
         """Disconnect all workers, destroy context."""
         while self.workers:
-            self.delete_worker(self.workers.values()[0], True)
+            self.delete_worker(next(iter(self.workers.values())), True)
         self.ctx.destroy(0)
 
-    def process_client(self, sender, msg):
-        """Process a request coming from a client."""
-        assert len(msg) >= 2  # Service name + body
-        service = msg.pop(0)
-        # Set reply return address to client sender
-        msg = [sender, b""] + msg
+    def process_client(self, sender, msg, delimiter=1):
+        """Process a request coming from a client.
+
+        msg is the whole message as received: the return envelope up to the
+        empty frame at msg[delimiter], then header, service name and body.
+        """
+        assert len(msg) >= delimiter + 4  # Envelope, header, service name + body
+        service = frame_bytes(msg[delimiter + 2])
         if service.startswith(self.INTERNAL_SERVICE_PREFIX):
             self.service_internal(service, msg)
-        else:
-            self.dispatch(self.require_service(service), msg)
+            return
+
+        service = self.require_service(service)
+        if self.SERVICE_HWM is not None and len(service.requests) >= self.SERVICE_HWM:
+            # Queue is full: push back on the client instead of growing it
+            if self.verbose:
+                logging.info("I: rejecting request to %s", service.name)
+            msg[delimiter + 1] = MDP.C_STATUS
+            msg[delimiter + 3] = MDP.S_OVERLOADED
+            self.socket.send_multipart(msg[: delimiter + 4], copy=False)
+            return
+
+        # Shift the return envelope over the header and service frames,
+        # so msg[2:] is [sender, ..., b"", body...]
+        for i in range(delimiter, -1, -1):
+            msg[i + 2] = msg[i]
+        self.dispatch(service, msg)
 
     def process_worker(self, sender, msg):
-        """Process message sent to us by a worker."""
-        assert len(msg) >= 1  # At least, command
+        """Process message sent to us by a worker.
 
-        command = msg.pop(0)
+        msg is the whole message as received, envelope and header included.
+        """
+        assert len(msg) >= 4  # Envelope, header and command
+
+        command = frame_bytes(msg[3])
 
         worker_ready = hexlify(sender) in self.workers
 
         worker = self.require_worker(sender)
 
         if MDP.W_READY == command:
-            assert len(msg) >= 1  # At least, a service name
-            service = msg.pop(0)
+            assert len(msg) >= 5  # At least, a service name
+            service = frame_bytes(msg[4])
             # Not first command in session or Reserved service name
             if worker_ready or service.startswith(self.INTERNAL_SERVICE_PREFIX):
                 self.delete_worker(worker, True)
@@ -160,19 +215,26 @@ class MajorDomoBroker(object):
 
         elif MDP.W_REPLY == command:
             if worker_ready:
-                # Remove & save client return envelope and insert the
-                # protocol header and service name, then rewrap envelope.
-                client = msg.pop(0)
-                empty = msg.pop(0)  # ?
-                msg = [client, b"", MDP.C_CLIENT, worker.service.name] + msg
-                self.socket.send_multipart(msg)
+                # msg[4:] is the client return envelope and the body: shift
+                # the envelope over the worker header and command frames,
+                # then rewrap with the protocol header and service name.
+                delimiter = find_delimiter(msg, 4)
+                assert delimiter < len(msg)
+                for i in range(4, delimiter + 1):
+                    msg[i - 2] = msg[i]
+                msg[delimiter - 1] = MDP.C_CLIENT
+                msg[delimiter] = worker.service.name
+                send_envelope(self.socket, (), msg, 2)
                 self.worker_waiting(worker)
             else:
                 self.delete_worker(worker, True)
 
         elif MDP.W_HEARTBEAT == command:
             if worker_ready:
-                worker.expiry = time.time() + 1e-3 * self.HEARTBEAT_EXPIRY
+                worker.expiry = time.monotonic() + 1e-3 * self.HEARTBEAT_EXPIRY
+                # Keep the idle list sorted by expiry
+                if worker.identity in self.waiting:
+                    self.waiting.move_to_end(worker.identity)
             else:
                 self.delete_worker(worker, True)
 
@@ -187,9 +249,14 @@ class MajorDomoBroker(object):
         assert worker is not None
         if disconnect:
             self.send_to_worker(worker, MDP.W_DISCONNECT, None, None)
+        elif self.shard:
+            # Nothing goes to the worker, so tell the front end to forget it
+            self.socket.send_multipart([b"", MDP.W_DISCONNECT, worker.address])
 
         if worker.service is not None:
-            worker.service.waiting.remove(worker)
+            worker.service.waiting.pop(worker.identity, None)
+        self.waiting.pop(worker.identity, None)
+        self.heartbeat_wheel[worker.slot].pop(worker.identity, None)
         self.workers.pop(worker.identity)
 
     def require_worker(self, address):
@@ -198,7 +265,8 @@ class MajorDomoBroker(object):
         identity = hexlify(address)
         worker = self.workers.get(identity)
         if worker is None:
-            worker = Worker(identity, address, self.HEARTBEAT_EXPIRY)
+            worker = Worker(identity, address, self.HEARTBEAT_EXPIRY, self.next_slot)
+            self.next_slot = (self.next_slot + 1) % self.HEARTBEAT_SLOTS
             self.workers[identity] = worker
             if self.verbose:
                 logging.info("I: registering new worker: %s", identity)
@@ -223,64 +291,109 @@ class MajorDomoBroker(object):
         self.socket.bind(endpoint)
         logging.info("I: MDP broker/0.1.1 is active at %s", endpoint)
 
+    def connect(self, endpoint):
+        """Connect broker shard to its front end."""
+        self.socket.connect(endpoint)
+
     def service_internal(self, service, msg):
         """Handle internal service according to 8/MMI specification"""
         returncode = b"501"
         if b"mmi.service" == service:
-            name = msg[-1]
+            name = frame_bytes(msg[-1])
             returncode = b"200" if name in self.services else b"404"
         msg[-1] = returncode
 
-        # insert the protocol header and service name after the routing envelope ([client, ''])
-        msg = msg[:2] + [MDP.C_CLIENT, service] + msg[2:]
-        self.socket.send_multipart(msg)
+        # msg is the request as received, so the routing envelope, protocol
+        # header and service name are already in place
+        self.socket.send_multipart(msg, copy=False)
+
+    def send_heartbeats(self, now=None):
+        """Send heartbeats to idle workers if it's time
 
-    def send_heartbeats(self):
-        """Send heartbeats to idle workers if it's time"""
-        if time.time() > self.heartbeat_at:
-            for worker in self.waiting:
+        Workers are spread over HEARTBEAT_SLOTS slots of a timer wheel and
+        each tick only heartbeats one slot, so every idle worker still gets
+        one heartbeat per HEARTBEAT_INTERVAL, without a burst to all of them.
+        """
+        if now is None:
+            now = time.monotonic()
+        if now > self.heartbeat_at:
+            self.heartbeat_slot = (self.heartbeat_slot + 1) % self.HEARTBEAT_SLOTS
+            for worker in self.heartbeat_wheel[self.heartbeat_slot].values():
                 self.send_to_worker(worker, MDP.W_HEARTBEAT, None, None)
 
-            self.heartbeat_at = time.time() + 1e-3 * self.HEARTBEAT_INTERVAL
+            self.heartbeat_at = now + self.heartbeat_tick
 
-    def purge_workers(self):
+    def purge_workers(self, now=None):
         """Look for & kill expired workers.
 
         Workers are oldest to most recent, so we stop at the first alive worker.
         """
+        if now is None:
+            now = time.monotonic()
         while self.waiting:
-            w = self.waiting[0]
-            if w.expiry < time.time():
+            w = next(iter(self.waiting.values()))
+            if w.expiry < now:
                 logging.info("I: deleting expired worker: %s", w.identity)
                 self.delete_worker(w, False)
-                self.waiting.pop(0)
             else:
                 break
 
+    def purge_requests(self, now=None):
+        """Drop requests queued for longer than REQUEST_TTL.
+
+        Requests are oldest to most recent, so we stop at the first fresh one.
+        The client has given up on them by now, so they are dropped silently.
+        """
+        if self.REQUEST_TTL is None:
+            return
+        if now is None:
+            now = time.monotonic()
+        for service in self.services.values():
+            self.purge_service_requests(service, now)
+
+    def purge_service_requests(self, service, now):
+        """Drop the requests to one service queued for longer than REQUEST_TTL."""
+        oldest = now - 1e-3 * self.REQUEST_TTL
+        requests = service.requests
+        while requests and requests[0][0] < oldest:
+            requests.popleft()
+            if self.verbose:
+                logging.info("I: dropping stale request to %s", service.name)
+
     def worker_waiting(self, worker):
         """This worker is now waiting for work."""
         # Queue to broker and service waiting lists
-        self.waiting.append(worker)
-        worker.service.waiting.append(worker)
-        worker.expiry = time.time() + 1e-3 * self.HEARTBEAT_EXPIRY
+        self.waiting[worker.identity] = worker
+        worker.service.waiting[worker.identity] = worker
+        self.heartbeat_wheel[worker.slot][worker.identity] = worker
+        worker.expiry = time.monotonic() + 1e-3 * self.HEARTBEAT_EXPIRY
         self.dispatch(worker.service, None)
 
     def dispatch(self, service, msg):
-        """Dispatch requests to waiting workers as possible"""
+        """Dispatch requests to waiting workers as possible
+
+        Requests past REQUEST_TTL are dropped here too, as purge_requests()
+        only runs once per poll: a worker coming back in between must not
+        be sent one.
+        """
         assert service is not None
+        now = time.monotonic()
         if msg is not None:  # Queue message if any
-            service.requests.append(msg)
-        self.purge_workers()
+            service.requests.append((now, msg))
+        self.purge_workers(now)
+        if self.REQUEST_TTL is not None and service.waiting:
+            self.purge_service_requests(service, now)
         while service.waiting and service.requests:
-            msg = service.requests.pop(0)
-            worker = service.waiting.pop(0)
-            self.waiting.remove(worker)
-            self.send_to_worker(worker, MDP.W_REQUEST, None, msg)
+            _, msg = service.requests.popleft()
+            _, worker = service.waiting.popitem(last=False)
+            self.waiting.pop(worker.identity)
+            self.heartbeat_wheel[worker.slot].pop(worker.identity)
+            self.send_to_worker(worker, MDP.W_REQUEST, None, msg, 2)
 
-    def send_to_worker(self, worker, command, option, msg=None):
+    def send_to_worker(self, worker, command, option, msg=None, start=0):
         """Send message to worker.
 
-        If message is provided, sends that message.
+        If message is provided, sends msg[start:].
         """
 
         if msg is None:
@@ -291,20 +404,156 @@ class MajorDomoBroker(object):
         # Stack routing and protocol envelopes to start of message
         # and routing envelope
         if option is not None:
-            msg = [option] + msg
-        msg = [worker.address, b"", MDP.W_WORKER, command] + msg
+            envelope = (worker.address, b"", MDP.W_WORKER, command, option)
+        else:
+            envelope = (worker.address, b"", MDP.W_WORKER, command)
 
         if self.verbose:
             logging.info("I: sending %r to worker", command)
+            dump(list(envelope) + msg[start:])
+
+        send_envelope(self.socket, envelope, msg, start)
+
+
+class MajorDomoShardedBroker(object):
+    """
+    Majordomo Protocol broker, sharded by service name
+
+    A front ROUTER hashes every message on its service name and hands it
+    over inproc to one of N MajorDomoBroker shards, each running in its own
+    thread with its own services and workers tables. Workers only name
+    their service in READY, so the front remembers which shard owns each
+    worker, until the shard deletes it. mmi.service requests go to the shard owning the service asked
+    about, so the lookup works across shards.
+    """
+
+    ctx = None  # Our context
+    socket = None  # Socket for clients & workers
+    poller = None  # our Poller
+
+    pipes = None  # inproc PAIR sockets, one per shard
+    shards = None  # MajorDomoBroker per shard
+    workers = None  # worker address -> shard index
+
+    verbose = False  # Print activity to stdout
+
+    def __init__(self, shards, verbose=False):
+        """Initialize front end and start shard threads."""
+        self.verbose = verbose
+        self.workers = {}
+        self.pipes = []
+        self.shards = []
+        self.ctx = zmq.Context()
+        self.socket = self.ctx.socket(zmq.ROUTER)
+        self.socket.linger = 0
+        self.socket.copy_threshold = MajorDomoBroker.COPY_THRESHOLD
+        self.poller = zmq.Poller()
+        self.poller.register(self.socket, zmq.POLLIN)
+        for n in range(shards):
+            endpoint = "inproc://md-shard-%d" % n
+            pipe = self.ctx.socket(zmq.PAIR)
+            pipe.linger = 0
+            pipe.bind(endpoint)
+            self.poller.register(pipe, zmq.POLLIN)
+            self.pipes.append(pipe)
+
+            shard = MajorDomoBroker(verbose, self.ctx, zmq.PAIR)
+            shard.connect(endpoint)
+            self.shards.append(shard)
+            # daemon, so shards go away with the front end's thread
+            threading.Thread(target=shard.mediate, daemon=True).start()
+
+    def bind(self, endpoint):
+        """Bind broker to endpoint, can call this multiple times."""
+        self.socket.bind(endpoint)
+        logging.info(
+            "I: MDP broker/0.1.1 is active at %s with %d shards",
+            endpoint,
+            len(self.shards),
+        )
+
+    def mediate(self):
+        """Forward messages between the front socket and the shards"""
+        while True:
+            try:
+                items = self.poller.poll()
+            except KeyboardInterrupt:
+                break  # Interrupted
+            for socket, _ in items:
+                msg = socket.recv_multipart(copy=False)
+                if socket is self.socket:
+                    self.route(msg)
+                else:
+                    self.forward(msg)
+
+    def shard_for(self, name):
+        """Index of the shard owning a service name."""
+        return zlib.crc32(name) % len(self.shards)
+
+    def route(self, msg):
+        """Hand a message from a client or worker to the owning shard."""
+        if len(msg) < 4:
+            logging.error("E: invalid message:")
+            dump(msg)
+            return
+        delimiter = find_delimiter(msg)
+        if len(msg) < delimiter + 3:
+            logging.error("E: invalid message:")
+            dump(msg)
+            return
+        sender = frame_bytes(msg[0])
+        header = frame_bytes(msg[delimiter + 1])
+        option = frame_bytes(msg[delimiter + 2])
+
+        if MDP.C_CLIENT == header:
+            if b"mmi.service" == option:
+                shard = self.shard_for(frame_bytes(msg[-1]))
+            else:
+                shard = self.shard_for(option)
+        elif MDP.W_WORKER == header:
+            shard = self.workers.get(sender)
+            if MDP.W_READY == option and shard is None and len(msg) > delimiter + 3:
+                shard = self.shard_for(frame_bytes(msg[delimiter + 3]))
+                self.workers[sender] = shard
+            elif MDP.W_DISCONNECT == option:
+                self.workers.pop(sender, None)
+            if shard is None:
+                # Unknown worker, any shard will tell it to disconnect
+                shard = 0
+        else:
+            logging.error("E: invalid message:")
             dump(msg)
+            return
+
+        self.pipes[shard].send_multipart(msg, copy=False)
 
-        self.socket.send_multipart(msg)
+    def forward(self, msg):
+        """Send a message from a shard to its client or worker.
+
+        An empty first frame, where the address would be, is for the front
+        end itself: DISCONNECT and the address of a worker the shard deleted
+        without telling it, as when it expired.
+        """
+        if not frame_bytes(msg[0]):
+            self.workers.pop(frame_bytes(msg[2]), None)
+            return
+        header = frame_bytes(msg[2])
+        if MDP.W_WORKER == header and MDP.W_DISCONNECT == frame_bytes(msg[3]):
+            self.workers.pop(frame_bytes(msg[0]), None)
+        self.socket.send_multipart(msg, copy=False)
 
 
 def main():
-    """create and start new broker"""
+    """create and start new broker
+
+    Pass --shards N to run N broker shards behind one front end.
+    """
     verbose = "-v" in sys.argv
-    broker = MajorDomoBroker(verbose)
+    if "--shards" in sys.argv:
+        shards = int(sys.argv[sys.argv.index("--shards") + 1])
+        broker = MajorDomoShardedBroker(shards, verbose)
+    else:
+        broker = MajorDomoBroker(verbose)
     broker.bind("tcp://*:5555")
     broker.mediate()
 
@@ -0,0 +1,76 @@
+"""
+Majordomo broker routing performance test
+
+Drives MajorDomoBroker's bookkeeping directly (no network I/O) and prints
+routed messages/sec and p99 dispatch latency for a growing number of idle
+workers. Heartbeat ticks are sped up so the heartbeat cost shows in the
+latency figures.
+"""
+
+import sys
+import time
+
+import MDP
+from md_broker import MajorDomoBroker
+
+
+class NullSocket(object):
+    """Stands in for the ROUTER socket, dropping outgoing messages"""
+
+    def send(self, frame, *args, **kwargs):
+        pass
+
+    def send_multipart(self, msg, *args, **kwargs):
+        pass
+
+
+HEARTBEAT_INTERVAL = 50  # msecs
+
+
+def test(n_workers, n_messages):
+    broker = MajorDomoBroker()
+    broker.socket.close()
+    broker.socket = NullSocket()
+    broker.heartbeat_tick = 1e-3 * HEARTBEAT_INTERVAL / broker.HEARTBEAT_SLOTS
+    service = b"echo"
+    client = b"client"
+    addresses = [b"worker-%08d" % i for i in range(n_workers)]
+    for address in addresses:
+        broker.process_worker(address, [address, b"", MDP.W_WORKER, MDP.W_READY, service])
+
+    latencies = []
+    t0 = time.perf_counter()
+    for i in range(n_messages):
+        t1 = time.perf_counter()
+        # request goes to the oldest idle worker, whose reply puts it back
+        # at the end of the queue, so every worker gets its turn
+        request = [client, b"", MDP.C_CLIENT, service, b"Hello world"]
+        broker.process_client(client, request)
+        address = addresses[i % n_workers]
+        reply = [address, b"", MDP.W_WORKER, MDP.W_REPLY, client, b"", b"Hello world"]
+        broker.process_worker(address, reply)
+        # same housekeeping as one MajorDomoBroker.mediate() iteration
+        now = time.monotonic()
+        broker.purge_workers(now)
+        broker.send_heartbeats(now)
+        latencies.append(time.perf_counter() - t1)
+    elapsed = time.perf_counter() - t0
+
+    broker.ctx.destroy(0)
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)]
+    # a request and its reply per iteration; heartbeats are not counted
+    return 2 * n_messages / elapsed, p99
+
+
+def main():
+    n_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print("|  workers|    msgs/sec|  p99 usecs")
+    for exponent in range(0, 5):
+        n_workers = 10**exponent
+        rate, p99 = test(n_workers, n_messages)
+        print(f"|{n_workers:9d}|{rate:12.0f}|{p99 * 1e6:11.1f}")
+
+
+if __name__ == "__main__":
+    main()
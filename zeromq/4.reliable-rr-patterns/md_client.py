@@ -11,7 +11,7 @@ import sys
 
 import MDP
 import zmq
-from zhelpers import dump
+from zhelpers import dump, frame_bytes, send_envelope
 
 
 class MajorDomoClient(object):
@@ -26,6 +26,7 @@ class MajorDomoClient(object):
     poller = None
     timeout = 2500
     verbose = False
+    copy_threshold = zmq.COPY_THRESHOLD  # bytes, larger frames go zero-copy
 
     def __init__(self, broker, verbose=False):
         """
@@ -49,6 +50,7 @@ class MajorDomoClient(object):
             self.client.close()
         self.client = self.ctx.socket(zmq.DEALER)
         self.client.linger = 0
+        self.client.copy_threshold = self.copy_threshold
         self.client.connect(self.broker)
         self.poller.register(self.client, zmq.POLLIN)
         if self.verbose:
@@ -64,14 +66,19 @@ class MajorDomoClient(object):
         # Frame 1: "MDPCxy" (six bytes, MDP/Client x.y)
         # Frame 2: Service name (printable string)
 
-        request = [b"", MDP.C_CLIENT, service] + request
+        envelope = (b"", MDP.C_CLIENT, service)
         if self.verbose:
             logging.warn("I: send request to '%s' service: ", service)
-            dump(request)
-        self.client.send_multipart(request)
+            dump(list(envelope) + request)
+        send_envelope(self.client, envelope, request)
 
     def recv(self):
-        """Returns the reply message or None if there was no reply."""
+        """Returns the reply message or None if there was no reply.
+
+        Reply frames are memoryviews over the received, uncopied, frames.
+        A request the broker rejected, because the service is overloaded,
+        got no reply either.
+        """
         try:
             items = self.poller.poll(self.timeout)
         except KeyboardInterrupt:
@@ -79,7 +86,7 @@ class MajorDomoClient(object):
 
         if items:
             # if we got a reply, process it
-            msg = self.client.recv_multipart()
+            msg = self.client.recv_multipart(copy=False)
             if self.verbose:
                 logging.info("I: received reply:")
                 dump(msg)
@@ -87,12 +94,20 @@ class MajorDomoClient(object):
             # Don't try to handle errors, just assert noisily
             assert len(msg) >= 4
 
-            empty = msg.pop(0)
-            header = msg.pop(0)
+            assert len(msg[0]) == 0
+            header = frame_bytes(msg[1])
+            if MDP.C_STATUS == header:
+                # msg[3] is the status code, from the broker, not a worker
+                logging.warn(
+                    "W: %s rejected with status %s, abandoning request",
+                    frame_bytes(msg[2]),
+                    frame_bytes(msg[3]),
+                )
+                return
             assert MDP.C_CLIENT == header
 
-            service = msg.pop(0)
-            return msg
+            # msg[2] is the service name
+            return [frame.buffer for frame in msg[3:]]
         else:
             logging.warn("W: permanent error, abandoning request")
 
@@ -104,7 +119,8 @@ def main():
     while count < 100000:
         request = b"Hello world"
         try:
-            reply = client.send(b"echo", request)
+            client.send(b"echo", request)
+            reply = client.recv()
         except KeyboardInterrupt:
             break
         else:
@@ -0,0 +1,192 @@
+"""Majordomo Protocol Client API, asyncio version.
+
+Implements the MDP/Client spec at http:#rfc.zeromq.org/spec:7, with many
+requests in flight over a single DEALER socket.
+
+Each request goes out with a correlation tag stacked in front of the empty
+delimiter frame, like an extra address. The broker and workers carry the
+whole return envelope through, so the reply comes back with the same tag
+and is matched to its request.
+
+Flow control is credit based: a client holds at most max_in_flight
+requests at once, and backs off when the broker answers that a service
+queue is full.
+"""
+
+import asyncio
+import itertools
+import logging
+import sys
+import time
+
+import MDP
+import zmq
+import zmq.asyncio
+from zhelpers import dump, frame_bytes
+
+
+class AsyncMajorDomoClient(object):
+    """Majordomo Protocol Client API, asyncio version.
+
+    Use ``await client.request(service, request)`` from as many tasks as
+    needed; they all share one socket.
+    """
+
+    broker = None
+    ctx = None
+    client = None
+    timeout = 2500  # msecs, per attempt
+    retries = 3  # attempts after the first one
+    max_in_flight = 1000  # credits: most requests in flight at once
+    backoff = 100  # msecs to wait when the broker is overloaded
+    verbose = False
+    copy_threshold = zmq.COPY_THRESHOLD  # bytes, larger frames go zero-copy
+
+    credits = None  # Semaphore of max_in_flight credits
+    pending = None  # correlation tag -> Future of the reply
+    tags = None  # correlation tag source
+    receiver = None  # Task reading replies
+
+    def __init__(self, broker, verbose=False):
+        """
+        Initialize needed variables, then connect to the broker
+        """
+        self.broker = broker
+        self.verbose = verbose
+        self.credits = asyncio.Semaphore(self.max_in_flight)
+        self.pending = {}
+        self.tags = itertools.count()
+        self.ctx = zmq.asyncio.Context()
+        logging.basicConfig(
+            format="%(asctime)s %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+            level=logging.INFO,
+        )
+        self.client = self.ctx.socket(zmq.DEALER)
+        self.client.linger = 0
+        self.client.copy_threshold = self.copy_threshold
+        self.client.connect(self.broker)
+        if self.verbose:
+            logging.info("I: connecting to broker at %s...", self.broker)
+
+    async def request(self, service, request, timeout=None, retries=None):
+        """Send request to broker and return the reply.
+
+        Every attempt gets a new tag, so a late reply to an abandoned
+        attempt is dropped. A request the broker rejects as overloaded
+        counts as an attempt too, retried after a backoff. Returns None
+        once all attempts failed.
+        """
+        if not isinstance(request, list):
+            request = [request]
+        if timeout is None:
+            timeout = self.timeout
+        if retries is None:
+            retries = self.retries
+        if self.receiver is None:
+            self.receiver = asyncio.ensure_future(self.recv_replies())
+
+        for attempt in range(retries + 1):
+            tag = next(self.tags).to_bytes(8, "big")
+            future = asyncio.get_running_loop().create_future()
+            self.pending[tag] = future
+            try:
+                async with self.credits:
+                    await self.send(tag, service, request)
+                    reply = await asyncio.wait_for(future, 1e-3 * timeout)
+            except asyncio.TimeoutError:
+                if self.verbose:
+                    logging.warning("W: no reply, retrying...")
+                continue
+            finally:
+                self.pending.pop(tag, None)
+
+            if reply is not None:  # else, a status from the broker
+                return reply
+            if self.verbose:
+                logging.warning("W: %s is overloaded, backing off...", service)
+            await asyncio.sleep(1e-3 * self.backoff)
+
+        logging.warning("W: permanent error, abandoning request")
+
+    async def send(self, tag, service, request):
+        """Send tagged request to broker"""
+        # Frame 0: correlation tag
+        # Frame 1: empty (REQ emulation)
+        # Frame 2: "MDPCxy" (six bytes, MDP/Client x.y)
+        # Frame 3: Service name (printable string)
+        request = [tag, b"", MDP.C_CLIENT, service, *request]
+        if self.verbose:
+            logging.info("I: send request to '%s' service: ", service)
+            dump(request)
+        await self.client.send_multipart(request, copy=False)
+
+    async def recv_replies(self):
+        """Resolve pending requests as their replies arrive"""
+        while True:
+            msg = await self.client.recv_multipart(copy=False)
+            if self.verbose:
+                logging.info("I: received reply:")
+                dump(msg)
+
+            # Don't try to handle errors, just assert noisily
+            assert len(msg) >= 5
+
+            tag = frame_bytes(msg[0])
+            assert len(msg[1]) == 0
+            header = frame_bytes(msg[2])
+            if MDP.C_STATUS == header:
+                # msg[4] is the status code, from the broker, not a worker:
+                # the request was rejected, so the attempt has no reply
+                reply = None
+            else:
+                assert MDP.C_CLIENT == header
+                reply = [frame.buffer for frame in msg[4:]]
+
+            # msg[3] is the service name
+            future = self.pending.pop(tag, None)
+            if future is not None and not future.done():
+                future.set_result(reply)
+
+    def destroy(self):
+        if self.receiver is not None:
+            self.receiver.cancel()
+        self.ctx.destroy(0)
+
+
+async def run(client, requests, in_flight):
+    """Send requests from in_flight tasks, each waiting for its replies"""
+
+    async def sender(count):
+        done = 0
+        for _ in range(count):
+            reply = await client.request(b"echo", b"Hello world")
+            if reply is None:
+                break
+            done += 1
+        return done
+
+    counts = [requests // in_flight] * in_flight
+    counts[0] += requests % in_flight
+    return sum(await asyncio.gather(*(sender(count) for count in counts)))
+
+
+def main():
+    """Pass --in-flight N to keep N requests in flight (default 100)."""
+    verbose = "-v" in sys.argv
+    in_flight = 100
+    if "--in-flight" in sys.argv:
+        in_flight = int(sys.argv[sys.argv.index("--in-flight") + 1])
+    client = AsyncMajorDomoClient("tcp://localhost:5555", verbose)
+    t0 = time.perf_counter()
+    try:
+        count = asyncio.run(run(client, 100000, in_flight))
+    except KeyboardInterrupt:
+        count = 0
+    elapsed = time.perf_counter() - t0
+    print("%i requests/replies processed, %.0f/sec" % (count, count / elapsed))
+    client.destroy()
+
+
+if __name__ == "__main__":
+    main()
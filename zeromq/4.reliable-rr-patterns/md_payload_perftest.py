@@ -0,0 +1,78 @@
+"""
+Majordomo payload size performance test
+
+Runs a broker and an echo worker in their own processes and prints
+request/reply round trips per second for 1 KiB, 64 KiB and 1 MiB bodies,
+with zero-copy sends above the default threshold and with every frame
+copied.
+"""
+
+import multiprocessing
+import sys
+import time
+
+from md_broker import MajorDomoBroker
+from md_client import MajorDomoClient
+from md_worker import MajorDomoWorker
+
+ENDPOINT = "tcp://127.0.0.1:5555"
+SIZES = [1 << 10, 64 << 10, 1 << 20]
+NO_ZERO_COPY = 2**31 - 1  # a copy_threshold no frame reaches
+
+
+def run_broker(copy_threshold):
+    MajorDomoBroker.COPY_THRESHOLD = copy_threshold
+    broker = MajorDomoBroker()
+    broker.bind(ENDPOINT)
+    broker.mediate()
+
+
+def run_worker(copy_threshold):
+    MajorDomoWorker.copy_threshold = copy_threshold
+    worker = MajorDomoWorker(ENDPOINT, b"echo")
+    reply = None
+    while True:
+        request = worker.recv(reply)
+        if request is None:
+            break
+        reply = request
+
+
+def test(copy_threshold, size, n_requests):
+    processes = [
+        multiprocessing.Process(target=run_broker, args=(copy_threshold,)),
+        multiprocessing.Process(target=run_worker, args=(copy_threshold,)),
+    ]
+    for process in processes:
+        process.start()
+    MajorDomoClient.copy_threshold = copy_threshold
+    client = MajorDomoClient(ENDPOINT)
+    body = b"x" * size
+    client.send(b"echo", body)  # wait for the worker to be ready
+    assert client.recv() is not None
+
+    t0 = time.perf_counter()
+    for _ in range(n_requests):
+        client.send(b"echo", body)
+        reply = client.recv()
+        assert reply is not None and len(reply[0]) == size
+    elapsed = time.perf_counter() - t0
+
+    client.ctx.destroy(0)
+    for process in processes:
+        process.terminate()
+        process.join()
+    return n_requests / elapsed
+
+
+def main():
+    n_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print("|     size|   copy req/s|zero-copy req/s")
+    for size in SIZES:
+        copied = test(NO_ZERO_COPY, size, n_requests)
+        zero_copy = test(MajorDomoBroker.COPY_THRESHOLD, size, n_requests)
+        print(f"|{size:9d}|{copied:13.0f}|{zero_copy:15.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Majordomo broker overload soak test
+
+Drives MajorDomoBroker's bookkeeping directly (no network I/O) with
+clients offering twice the load its workers can serve, and prints queue
+length, traced memory, p99 queueing latency and rejected requests for an
+unbounded queue, a bounded queue, and a bounded queue with request TTL.
+Then checks that no request past its TTL goes to a worker that comes
+back between two purges.
+"""
+
+import sys
+import time
+import tracemalloc
+from collections import deque
+
+import MDP
+import zmq
+from md_broker import MajorDomoBroker
+
+N_WORKERS = 10
+OFFERED = 2  # requests offered per request served
+BODY = b"x" * 1024
+
+
+class RecordingSocket(object):
+    """Stands in for the ROUTER socket, keeping requests sent to workers"""
+
+    def __init__(self):
+        self.frames = []
+        self.requests = deque()  # (worker address, client address)
+        self.rejected = 0
+
+    def send(self, frame, flags=0, *args, **kwargs):
+        self.frames.append(frame)
+        if not flags & zmq.SNDMORE:
+            self.send_multipart(self.frames)
+            self.frames = []
+
+    def send_multipart(self, msg, *args, **kwargs):
+        if msg[2] == MDP.W_WORKER and msg[3] == MDP.W_REQUEST:
+            self.requests.append((msg[0], msg[4]))
+        elif msg[2] == MDP.C_STATUS and msg[4] == MDP.S_OVERLOADED:
+            self.rejected += 1
+
+
+def test(hwm, ttl, seconds):
+    MajorDomoBroker.SERVICE_HWM = hwm
+    MajorDomoBroker.REQUEST_TTL = ttl
+    broker = MajorDomoBroker()
+    broker.socket.close()
+    broker.socket = socket = RecordingSocket()
+    service = b"echo"
+    for i in range(N_WORKERS):
+        address = b"worker-%d" % i
+        broker.process_worker(address, [address, b"", MDP.W_WORKER, MDP.W_READY, service])
+
+    tracemalloc.start()
+    latencies = []
+    t_end = time.monotonic() + seconds
+    while time.monotonic() < t_end:
+        for _ in range(OFFERED):
+            # client addresses carry the time the request was sent
+            client = b"%.9f" % time.monotonic()
+            broker.process_client(client, [client, b"", MDP.C_CLIENT, service, BODY])
+        # One worker finishes a request
+        if socket.requests:
+            address, client = socket.requests.popleft()
+            latencies.append(time.monotonic() - float(client))
+            reply = [address, b"", MDP.W_WORKER, MDP.W_REPLY, client, b"", BODY]
+            broker.process_worker(address, reply)
+        broker.purge_requests()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    queued = len(broker.services[service].requests)
+    broker.ctx.destroy(0)
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)]
+    return queued, peak, p99, socket.rejected
+
+
+def late_worker(ttl):
+    """Queue requests with no worker idle, then have a worker come back
+    before the next purge; return how many of them past ttl it was sent"""
+    MajorDomoBroker.SERVICE_HWM = None
+    MajorDomoBroker.REQUEST_TTL = ttl
+    broker = MajorDomoBroker()
+    broker.socket.close()
+    broker.socket = socket = RecordingSocket()
+    service = b"echo"
+    for _ in range(N_WORKERS):
+        client = b"%.9f" % time.monotonic()
+        broker.process_client(client, [client, b"", MDP.C_CLIENT, service, BODY])
+    time.sleep(2e-3 * ttl)  # no purge_requests() in between
+    address = b"worker"
+    broker.process_worker(address, [address, b"", MDP.W_WORKER, MDP.W_READY, service])
+    broker.ctx.destroy(0)
+    return len(socket.requests)
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print("|   hwm|   ttl|   queued| peak KiB|  p99 msecs| rejected")
+    for hwm, ttl in [(None, None), (1000, None), (1000, 50)]:
+        queued, peak, p99, rejected = test(hwm, ttl, seconds)
+        print(
+            f"|{hwm!s:>6}|{ttl!s:>6}|{queued:9d}|{peak / 1024:9.0f}"
+            f"|{p99 * 1e3:11.2f}|{rejected:9d}"
+        )
+    stale = late_worker(50)
+    print(f"requests past ttl sent to a late worker: {stale}")
+    assert stale == 0
+
+
+if __name__ == "__main__":
+    main()
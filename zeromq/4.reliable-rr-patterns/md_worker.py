@@ -13,7 +13,7 @@ import time
 # MajorDomo protocol constants:
 import MDP
 import zmq
-from zhelpers import dump
+from zhelpers import dump, find_delimiter, frame_bytes, send_envelope
 
 
 class MajorDomoWorker(object):
@@ -38,6 +38,7 @@ class MajorDomoWorker(object):
 
     timeout = 2500  # poller timeout
     verbose = False  # Print activity to stdout
+    copy_threshold = zmq.COPY_THRESHOLD  # bytes, larger frames go zero-copy
 
     # Return address, if any
     reply_to = None
@@ -62,6 +63,7 @@ class MajorDomoWorker(object):
             self.worker.close()
         self.worker = self.ctx.socket(zmq.DEALER)
         self.worker.linger = 0
+        self.worker.copy_threshold = self.copy_threshold
         self.worker.connect(self.broker)
         self.poller.register(self.worker, zmq.POLLIN)
         if self.verbose:
@@ -77,31 +79,37 @@ class MajorDomoWorker(object):
     def send_to_broker(self, command, option=None, msg=None):
         """Send message to broker.
 
-        If no msg is provided, creates one internally
+        If no msg is provided, creates one internally. option is a single
+        frame, or a list of frames such as a reply envelope.
         """
         if msg is None:
             msg = []
         elif not isinstance(msg, list):
             msg = [msg]
 
-        if option:
-            msg = [option] + msg
+        envelope = (b"", MDP.W_WORKER, command)
+        if isinstance(option, list):
+            envelope += tuple(option)
+        elif option:
+            envelope += (option,)
 
-        msg = [b"", MDP.W_WORKER, command] + msg
         if self.verbose:
             logging.info("I: sending %s to broker", command)
-            dump(msg)
-        self.worker.send_multipart(msg)
+            dump(list(envelope) + msg)
+        send_envelope(self.worker, envelope, msg)
 
     def recv(self, reply=None):
-        """Send reply, if any, to broker and wait for next request."""
+        """Send reply, if any, to broker and wait for next request.
+
+        Request frames are memoryviews over the received, uncopied, frames.
+        """
         # Format and send the reply if we were provided one
         assert reply is not None or not self.expect_reply
 
         if reply is not None:
             assert self.reply_to is not None
-            reply = [self.reply_to, b""] + reply
-            self.send_to_broker(MDP.W_REPLY, msg=reply)
+            # the reply_to envelope goes out as the command option
+            self.send_to_broker(MDP.W_REPLY, self.reply_to + [b""], reply)
 
         self.expect_reply = True
 
@@ -113,7 +121,7 @@ class MajorDomoWorker(object):
                 break  # Interrupted
 
             if items:
-                msg = self.worker.recv_multipart()
+                msg = self.worker.recv_multipart(copy=False)
                 if self.verbose:
                     logging.info("I: received message from broker: ")
                     dump(msg)
@@ -122,22 +130,21 @@ class MajorDomoWorker(object):
                 # Don't try to handle errors, just assert noisily
                 assert len(msg) >= 3
 
-                empty = msg.pop(0)
-                assert empty == b""
+                assert len(msg[0]) == 0
 
-                header = msg.pop(0)
+                header = frame_bytes(msg[1])
                 assert header == MDP.W_WORKER
 
-                command = msg.pop(0)
+                command = frame_bytes(msg[2])
                 if command == MDP.W_REQUEST:
-                    # We should pop and save as many addresses as there are
-                    # up to a null part, but for now, just save one...
-                    self.reply_to = msg.pop(0)
-                    # pop empty
-                    empty = msg.pop(0)
-                    assert empty == b""
-
-                    return msg  # We have a request to process
+                    # Save as many addresses as there are up to a null part:
+                    # the client address, and its correlation tag if any
+                    delimiter = find_delimiter(msg, 3)
+                    assert delimiter < len(msg)
+                    self.reply_to = msg[3:delimiter]
+
+                    # We have a request to process
+                    return [frame.buffer for frame in msg[delimiter + 1 :]]
                 elif command == MDP.W_HEARTBEAT:
                     # Do nothing for heartbeats
                     pass
@@ -25,10 +25,11 @@ def dump(msg_or_socket):
         msg = msg_or_socket
     print("----------------------------------------")
     for part in msg:
+        part = frame_bytes(part)
         print("[%03d]" % len(part))
         is_text = True
         for c in part:
-            if ord(c) < 32 or ord(c) > 128:
+            if c < 32 or c > 128:
                 is_text = False
                 break
         if is_text:
@@ -39,6 +40,35 @@ def dump(msg_or_socket):
             print(binascii.hexlify(part))
 
 
+# Bytes of a frame received with copy=False (or of a plain bytes frame)
+def frame_bytes(frame):
+    if isinstance(frame, zmq.Frame):
+        return frame.bytes
+    return frame
+
+
+def find_delimiter(msg, start=0):
+    """index of the first empty frame at or after start, len(msg) if none"""
+    for i in range(start, len(msg)):
+        if len(msg[i]) == 0:
+            return i
+    return len(msg)
+
+
+def send_envelope(socket, envelope, msg, start=0, copy=False):
+    """send envelope frames followed by msg[start:] as one message
+
+    The envelope is never joined to msg into a new list. With copy=False,
+    frames of socket.copy_threshold bytes or more are sent without copying.
+    """
+    end = len(msg)
+    last = len(envelope) - 1
+    for i, frame in enumerate(envelope):
+        socket.send(frame, zmq.SNDMORE if i < last or start < end else 0)
+    for i in range(start, end):
+        socket.send(msg[i], zmq.SNDMORE if i < end - 1 else 0, copy=copy)
+
+
 # Set simple random printable identity on socket
 def set_id(zsocket):
     identity = "%04x-%04x" % (randint(0, 0x10000), randint(0, 0x10000))